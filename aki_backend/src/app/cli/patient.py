@@ -1,7 +1,6 @@
+import click
 from flask import Blueprint
-from app.domain.patient.entities.patient import PatientMedicalRecord
-from app.domain.patient.services.patient_medical_record_service import PatientMedicalRecordService
-from app.inference.predict import predict_aki
+from app.domain.patient.services.prediction_service import PredictionService
 from config import Config
 
 patient = Blueprint('patient', __name__)
@@ -9,14 +8,12 @@ patient = Blueprint('patient', __name__)
 
 @patient.cli.command('predict')
 def predict():
-    records = PatientMedicalRecord.find_predictions_unknown(
-        Config.INFERENCE_BATCH_SIZE)
-    print(f"{len(records)} will be predicted ...")
+    PredictionService.predict_next_batch(Config.INFERENCE_BATCH_SIZE)
 
-    if len(records) == 0:
-        return None
-    
-    preds = predict_aki(records)
 
-    PatientMedicalRecordService.update_many_predictions(records, preds)
-    print("Predictions formed")
+@patient.cli.command('work')
+@click.option('--poll-interval', type=float, default=Config.INFERENCE_WORKER_POLL_INTERVAL)
+@click.option('--drain', is_flag=True, help='Exit once no unknown records are left')
+def work(poll_interval, drain):
+    print("Prediction worker started ...")
+    PredictionService.run_worker(Config.INFERENCE_BATCH_SIZE, poll_interval, drain)
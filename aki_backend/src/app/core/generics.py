@@ -102,12 +102,15 @@ class Seeder(ABC):
 
 class Controller(Resource):
     @classmethod
-    def response(cls, code: int = 200, message: str = gettext('success'), data=None, errors=None):
-        return {
+    def response(cls, code: int = 200, message: str = gettext('success'), data=None, errors=None, headers: Optional[dict] = None):
+        body = {
             APIItems.MESSAGE.value: message,
             APIItems.DATA.value: data,
             APIItems.ERRORS.value: errors,
-        }, code
+        }
+        if headers is not None:
+            return body, code, headers
+        return body, code
 
 
 class ListController(Controller):
@@ -0,0 +1,100 @@
+"""unique patient medical record per patient and reference date
+
+Revision ID: 3b9d2f6c1a7e
+Revises: 6f0f60fe54d0
+Create Date: 2026-10-18 10:12:41.218904
+
+"""
+import json
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9d2f6c1a7e'
+down_revision = '6f0f60fe54d0'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def entity_key(record_id):
+    # Same encoding as ActionHistory.encode_entity_key
+    return json.dumps({"id": record_id})
+
+
+def deduplicate_records(bind):
+    """Keep the latest record of every (patient_id, reference_date) and move
+    the evaluations and views of the others onto it."""
+    groups = bind.execute(sa.text(
+        "SELECT patient_id, reference_date, MAX(id) FROM patient_medical_records "
+        "GROUP BY patient_id, reference_date HAVING COUNT(*) > 1"
+    )).fetchall()
+
+    merges = []
+    for patient_id, reference_date, keep_id in groups:
+        stale_ids = bind.execute(sa.text(
+            "SELECT id FROM patient_medical_records "
+            "WHERE patient_id = :patient_id AND reference_date = :reference_date "
+            "AND id != :keep_id"
+        ), {"patient_id": patient_id, "reference_date": reference_date, "keep_id": keep_id}).scalars()
+        merges += [{"old_id": old_id, "keep_id": keep_id} for old_id in stale_ids]
+
+    if len(merges) == 0:
+        return
+    logger.info("Merging %d duplicate patient medical records", len(merges))
+
+    # Evaluations the kept record already has for the same user and column win
+    bind.execute(sa.text(
+        "DELETE FROM user_patient_medical_record_evaluations "
+        "WHERE patient_medical_record_id = :old_id AND EXISTS ("
+        "SELECT 1 FROM user_patient_medical_record_evaluations kept "
+        "WHERE kept.patient_medical_record_id = :keep_id "
+        "AND kept.user_id = user_patient_medical_record_evaluations.user_id "
+        "AND kept.column_name = user_patient_medical_record_evaluations.column_name)"
+    ), merges)
+    bind.execute(sa.text(
+        "UPDATE user_patient_medical_record_evaluations "
+        "SET patient_medical_record_id = :keep_id WHERE patient_medical_record_id = :old_id"
+    ), merges)
+    keys = [
+        {"keep_key": entity_key(merge["keep_id"]), "old_key": entity_key(merge["old_id"])}
+        for merge in merges
+    ]
+    bind.execute(sa.text(
+        "DELETE FROM action_history "
+        "WHERE entity = 'patient_medical_records' AND entity_key = :old_key AND EXISTS ("
+        "SELECT 1 FROM action_history kept "
+        "WHERE kept.entity = 'patient_medical_records' AND kept.entity_key = :keep_key "
+        "AND kept.user_id = action_history.user_id "
+        "AND kept.action_type = action_history.action_type "
+        "AND kept.created_at = action_history.created_at)"
+    ), keys)
+    bind.execute(sa.text(
+        "UPDATE action_history SET entity_key = :keep_key "
+        "WHERE entity = 'patient_medical_records' AND entity_key = :old_key"
+    ), keys)
+    bind.execute(sa.text(
+        "DELETE FROM patient_medical_records WHERE id = :old_id"
+    ), merges)
+
+
+def upgrade():
+    deduplicate_records(op.get_bind())
+
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('patient_medical_records', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_patient_medical_records_patient_id_reference_date', ['patient_id', 'reference_date'])
+
+    # ### end Alembic commands ###
+
+
+def downgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('patient_medical_records', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_patient_medical_records_patient_id_reference_date', type_='unique')
+
+    # ### end Alembic commands ###
@@ -0,0 +1,82 @@
+"""backfill patient medical record data digests
+
+Revision ID: 5d2e7b9c4f18
+Revises: 8c41e5a0d2f3
+Create Date: 2026-10-18 14:21:06.318572
+
+"""
+import json
+import math
+import hashlib
+
+from alembic import op
+import numpy as np
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e7b9c4f18'
+down_revision = '8c41e5a0d2f3'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+# Frozen copies of PatientMedicalRecord.get_canonical_value and get_data_digest,
+# so this revision keeps hashing the same way whatever the entity turns into
+def get_canonical_value(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        if value.is_integer():
+            return int(value)
+    return value
+
+
+def get_data_digest(data):
+    if data is None:
+        return None
+    data = {key: get_canonical_value(value) for key, value in data.items()}
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def upgrade():
+    # Every digest is recomputed, so rows hashed before values were
+    # normalised match the uploads that follow too
+    records = sa.table(
+        'patient_medical_records',
+        sa.column('id', sa.Integer),
+        sa.column('data', sa.JSON),
+        sa.column('data_digest', sa.String),
+    )
+    update = (
+        records.update()
+        .where(records.c.id == sa.bindparam('record_id'))
+        .values(data_digest=sa.bindparam('digest'))
+    )
+
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(records.c.id, records.c.data)
+            .where(records.c.id > last_id)
+            .order_by(records.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if len(rows) == 0:
+            break
+
+        bind.execute(update, [
+            {'record_id': record_id, 'digest': get_data_digest(data)}
+            for record_id, data in rows
+        ])
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    pass
@@ -1,5 +1,6 @@
 import os
 import json
+import hashlib
 from datetime import datetime
 
 from werkzeug.utils import secure_filename
@@ -39,6 +40,30 @@ class MediaService:
             return None
         return os.path.join(Config.UPLOAD_PATH, filename)
 
+    @classmethod
+    def get_media_hash(cls, value) -> str:
+        """sha256 of a stored file path or an uploaded file's stream."""
+        digest = hashlib.sha256()
+        if isinstance(value, str):
+            with open(value, "rb") as file:
+                for block in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(block)
+        else:
+            position = value.stream.tell()
+            for block in iter(lambda: value.stream.read(1 << 20), b""):
+                digest.update(block)
+            value.stream.seek(position)
+        return digest.hexdigest()
+
+    @classmethod
+    def get_cache_path(cls, key: str, ext: str) -> str:
+        target_dir = os.path.join(Config.APP_DIR, Config.UPLOAD_PATH, "cache")
+
+        if not os.path.isdir(target_dir):
+            os.makedirs(target_dir, mode=0o775)
+
+        return os.path.join(target_dir, f"{key}.{ext}")
+
     @classmethod
     def set_media(cls, path, value):
         if value is None or isinstance(value, str):
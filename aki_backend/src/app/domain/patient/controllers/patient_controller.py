@@ -2,7 +2,9 @@ from flask import request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy.orm import selectinload, subqueryload
 from typing import Dict, Tuple
+from werkzeug.http import quote_etag
 
+from app.core.cache import LRUCache
 from app.core.constants import APIItems
 from app.core.generics import ListController, Controller
 from app.domain.user.entities.user import User
@@ -33,6 +35,7 @@ from app.domain.patient.schemas.user_patient_medical_record_evaluation_schema im
     UserPatientMedicalRecordEvaluationSchema,
 )
 from app.core.view_decorators import admin_required
+from config import Config
 
 patient_schema = PatientSchema()
 patient_list_schema = PatientListSchema()
@@ -42,6 +45,8 @@ patient_record_predictions_schema = PatientMedicalRecordPredictionsSchema()
 user_patient_medical_record_evaluation_schema = (
     UserPatientMedicalRecordEvaluationSchema()
 )
+# Dumped prediction payloads keyed by the ETag of their record
+prediction_payloads = LRUCache(Config.PREDICTIONS_PAYLOAD_CACHE_SIZE)
 
 
 def get_records_keys_map(
@@ -243,7 +248,17 @@ class PatientMedicalRecordPredictions(Controller):
         user = User.find_by_id(get_jwt_identity())
         PatientMedicalRecordService.view(record, user.id)
 
-        return cls.response(data=patient_record_predictions_schema.dump(record))
+        etag = PatientMedicalRecordService.get_etag(
+            record, patient_record_predictions_schema.VERSION
+        )
+        headers = {"ETag": quote_etag(etag), "Cache-Control": "private, no-cache"}
+        if etag in request.if_none_match:
+            return "", 304, headers
+
+        payload = prediction_payloads.get_or_set(
+            etag, lambda: patient_record_predictions_schema.dump(record)
+        )
+        return cls.response(data=payload, headers=headers)
 
 
 class PatientUserInterestController(Controller):
@@ -1,10 +1,16 @@
 from enum import Enum
+import copy
+import json
+import math
+import hashlib
 import datetime as dt
-from functools import cache
+from functools import wraps
 from collections import defaultdict
 from typing import Optional, List, Dict
 
+import numpy as np
 from sqlalchemy.sql import func
+from sqlalchemy.orm import validates
 from sqlalchemy.dialects.postgresql import JSONB
 
 from app.inference.utils.columns import target as target_cols
@@ -15,6 +21,31 @@ from app.domain.patient.queries.patient_medical_record_query import (
 )
 from app.domain._shared.services.media_service import JSONMediaService
 
+
+def memoize_on_prediction(method):
+    """Memoize ``method`` on its record for as long as ``prediction`` is the
+    same object. The memo lives on the instance, so it goes away with it and
+    is dropped once the prediction is replaced or reloaded. Like the JSONB
+    column itself, it does not see ``prediction`` being changed in place.
+
+    Callers get a copy, so changing a result leaves the memo intact.
+    """
+
+    @wraps(method)
+    def wrapper(self, *args):
+        prediction, memo = self.__dict__.get("_prediction_memo", (None, None))
+        if memo is None or prediction is not self.prediction:
+            memo = {}
+            self._prediction_memo = (self.prediction, memo)
+
+        key = (method.__name__,) + args
+        if key not in memo:
+            memo[key] = method(self, *args)
+        return copy.deepcopy(memo[key])
+
+    return wrapper
+
+
 users_patients_table = db.Table(
     "users_patients",
     db.metadata,
@@ -72,7 +103,14 @@ class Patient(Entity):
 
 class PatientMedicalRecord(Entity):
     __tablename__ = "patient_medical_records"
-    __table_args__ = (db.UniqueConstraint("id", "reference_date"),)
+    __table_args__ = (
+        db.UniqueConstraint("id", "reference_date"),
+        db.UniqueConstraint(
+            "patient_id",
+            "reference_date",
+            name="uq_patient_medical_records_patient_id_reference_date",
+        ),
+    )
 
     query_class = PatientMedicalRecordQuery
 
@@ -109,10 +147,13 @@ class PatientMedicalRecord(Entity):
         db.Integer, db.ForeignKey(MedicalRecord.id, ondelete="RESTRICT")
     )
     data = Column(JSONB())
+    data_digest = Column(db.String(64), nullable=True)
     # _data_path = Column(db.String(255), nullable=True)
     reference_date = Column(db.DateTime)
     prediction_state = Column(db.Enum(PredictionStates))
     prediction = Column(JSONB(), nullable=True)
+    # Failed prediction attempts since the data last changed
+    prediction_attempts = Column(db.Integer, default=0, server_default="0")
     # _prediction_path = Column(db.String(255), nullable=True)
     actual_state = Column(db.Enum(PredictionStates), nullable=True)
     treatment = Column(db.Enum(Treatment), nullable=True)
@@ -173,6 +214,32 @@ class PatientMedicalRecord(Entity):
     #         JSONMediaService.remove_media(self._data_path)
     #     JSONMediaService.set_media("patient_medical_records/prediction", value)
 
+    @staticmethod
+    def get_canonical_value(value):
+        # Column dtypes are inferred per upload chunk, so the same value can
+        # arrive as a NumPy scalar, 1 or 1.0, and a missing one as NaN or None
+        if isinstance(value, np.generic):
+            value = value.item()
+        if isinstance(value, float):
+            if math.isnan(value):
+                return None
+            if value.is_integer():
+                return int(value)
+        return value
+
+    @classmethod
+    def get_data_digest(cls, data) -> Optional[str]:
+        if data is None:
+            return None
+        data = {key: cls.get_canonical_value(value) for key, value in data.items()}
+        canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    @validates("data")
+    def validate_data(self, key, value):
+        self.data_digest = self.get_data_digest(value)
+        return value
+
     @property
     def previous_actual_state(self) -> bool:
         if self.data is None:
@@ -193,6 +260,19 @@ class PatientMedicalRecord(Entity):
             .all()
         )
 
+    @classmethod
+    def claim_predictions_unknown(cls, limit=128, max_attempts: Optional[int] = None):
+        # Records that failed before queue up behind the fresh ones
+        query = cls.query.filter(cls.prediction_state == cls.PredictionStates.unknown)
+        if max_attempts is not None:
+            query = query.filter(cls.prediction_attempts < max_attempts)
+        return (
+            query.order_by(cls.prediction_attempts, cls.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+
     @classmethod
     def find_by_external_id_and_date(cls, external_id: int, date: dt.datetime):
         return cls.query.filter(
@@ -209,19 +289,24 @@ class PatientMedicalRecord(Entity):
 
         return False
 
-    @cache
+    @memoize_on_prediction
     def get_top_explanations_by_day(self, limit: int) -> Dict[str, Dict[str, float]]:
         if self.prediction is None or len(self.prediction.get("explanations", {})) == 0:
             return None
 
         top_explanations = {}
         for day, items in self.prediction["explanations"].items():
-            keys = sorted(items.keys(), key=items.__getitem__, reverse=True)[:limit]
-            top_explanations[day] = {key: items[key] for key in keys}
+            # Older predictions kept every attribution as a column -> score dict,
+            # newer ones only the top [column, score] pairs, largest first
+            if isinstance(items, dict):
+                keys = sorted(items.keys(), key=items.__getitem__, reverse=True)[:limit]
+                top_explanations[day] = {key: items[key] for key in keys}
+            else:
+                top_explanations[day] = dict(items[:limit])
 
         return top_explanations
 
-    @cache
+    @memoize_on_prediction
     def get_top_explanations_in_any(self, limit: int) -> Dict[str, List[str]]:
         top_exps_by_day = self.get_top_explanations_by_day(limit)
         if top_exps_by_day is None:
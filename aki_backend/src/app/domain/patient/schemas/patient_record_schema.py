@@ -77,6 +77,8 @@ class PatientMedicalRecordSchema(ma.SQLAlchemyAutoSchema):
 
 
 class PatientMedicalRecordPredictionsSchema(ma.SQLAlchemyAutoSchema):
+    # Part of the ETag of dumped payloads, bump whenever their shape changes
+    VERSION = 1
     LIMIT = 10
     TARGET_THRESHOLD = 0.5
 
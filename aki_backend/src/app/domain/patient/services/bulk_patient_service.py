@@ -1,12 +1,14 @@
 from typing import Dict, Optional, Sequence, List, Tuple
 from datetime import datetime
 
+import pandas as pd
 from sqlalchemy.orm import lazyload
 from sqlalchemy import select, insert
 from app import db
 
 from tqdm import tqdm
 
+from app.domain._shared.services.media_service import MediaService
 from app.domain.user.entities.user import User
 from app.domain.user.entities.department import Department, patients_departments_table
 from app.domain.user.services.department_service import DepartmentService
@@ -15,7 +17,8 @@ from app.domain.patient.entities.patient import Patient
 from app.domain.patient.services.patient_medical_record_service import (
     PatientMedicalRecordService,
 )
-from app.inference.preprocess import preprocess_file
+from app.inference.preprocess import preprocess_file_chunks
+from config import Config
 
 
 class BulkPatientService:
@@ -24,8 +27,21 @@ class BulkPatientService:
         filepath = medical_record.file_storage_path
 
         available_departments = Department.get_inference_ids_set()
-        data = preprocess_file(filepath, available_departments)
+        cache_path = MediaService.get_cache_path(
+            MediaService.get_media_hash(filepath), "parquet"
+        )
+        chunks = preprocess_file_chunks(
+            filepath,
+            available_departments,
+            Config.INFERENCE_CSV_CHUNK_SIZE,
+            cache_path,
+        )
 
+        for data in chunks:
+            cls.create_patients_from_data(data, medical_record.id)
+
+    @classmethod
+    def create_patients_from_data(cls, data: pd.DataFrame, medical_record_id: int):
         departments = data["department"].unique()
         dep_models = DepartmentService.find_or_create_many_by_external(departments)
         print("Departments created ...")
@@ -44,7 +60,7 @@ class BulkPatientService:
 
         print("Passed to create from records ...")
         PatientMedicalRecordService.find_or_create_many_from_records(
-            data, patient_models, medical_record.id
+            data, patient_models, medical_record_id
         )
 
     @classmethod
@@ -6,6 +6,7 @@ from app.core.database import db
 from app.domain.patient.entities.medical_record import MedicalRecord
 from app.domain.patient.entities.patient import MedicalRecord
 from app.domain.patient.services.bulk_patient_service import BulkPatientService as PatientService
+from app.domain.patient.services.patient_medical_record_service import PatientMedicalRecordService
 # from app.domain.patient.services.patient_service import PatientService
 
 
@@ -20,6 +21,7 @@ class MedicalRecordService:
             print("Record ready")
 
             PatientService.create_patients_from_medical_record(record)
+            PatientMedicalRecordService.notify_predictions_pending()
             print("Committing")
             db.session.commit()
             # except:
@@ -3,22 +3,30 @@ from collections import namedtuple
 from datetime import datetime
 from copy import deepcopy
 import warnings
-from typing import List, Tuple, Optional, Dict, Sequence, Any
+from typing import List, Tuple, Optional, Dict, Sequence, Any, Callable
 
 from sqlalchemy import text
 from sqlalchemy.orm import subqueryload
 
 from werkzeug.datastructures import FileStorage
 
-from sqlalchemy import insert, update
+from sqlalchemy import insert, update, func
+from sqlalchemy.dialects import postgresql, sqlite
 
 from app.core.database import db
 from app.domain.patient.entities.patient import PatientMedicalRecord, Patient
 from app.domain.user.entities.department import Department
 from app.domain.user.entities.action_history import ActionTypes
 from app.domain.user.services.action_history_service import ActionHistoryService
+from app.domain._shared.services.media_service import MediaService
 from app.inference.preprocess import preprocess_file
 from app.inference.utils.columns import target as target_cols
+from config import Config
+
+UPSERT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
 
 EvaluationStats = namedtuple(
     "EvaluationStats", ("total", "accuracy", "precision", "recall")
@@ -27,6 +35,7 @@ EvaluationStats = namedtuple(
 
 class PatientMedicalRecordService:
     INSERT_BATCH_SIZE = 1000
+    PREDICTIONS_CHANNEL = "patient_medical_records_unknown"
 
     @classmethod
     def find_or_new(
@@ -97,8 +106,21 @@ class PatientMedicalRecordService:
                 )
                 record.flush()
             db.session.commit()
+            return True
         except Exception as e:
             db.session.rollback()
+            return False
+
+    @classmethod
+    def notify_predictions_pending(cls):
+        if db.session.get_bind().dialect.name == "postgresql":
+            db.session.execute(text(f"NOTIFY {cls.PREDICTIONS_CHANNEL}"))
+
+    @classmethod
+    def get_etag(cls, patient_record: PatientMedicalRecord, version: int) -> str:
+        # Every write of a record moves its updated_at, ``version`` tells
+        # payloads of the same record dumped by other schemas apart
+        return f"{version}-{patient_record.id}-{patient_record.updated_at.isoformat()}"
 
     @classmethod
     def view(cls, patient_record: PatientMedicalRecord, user_id: int):
@@ -109,8 +131,18 @@ class PatientMedicalRecordService:
     @classmethod
     def evaluate_from_files(cls, files: List[FileStorage]):
         try:
+            available_departments = Department.get_inference_ids_set()
             for file in files:
-                data = preprocess_file(file.filename)
+                cache_path = MediaService.get_cache_path(
+                    MediaService.get_media_hash(file), "parquet"
+                )
+                data = preprocess_file(
+                    file.stream,
+                    available_departments,
+                    Config.INFERENCE_CSV_CHUNK_SIZE,
+                    cache_path,
+                    ["date_admin", *target_cols],
+                )
 
                 pos_patients = (data[target_cols] == 1).any(axis=1)
 
@@ -204,6 +236,12 @@ class PatientMedicalRecordService:
             patients: Sequence[Patient],
             medical_record_id: int,
     ):
+        dialect = db.session.get_bind().dialect.name
+        if dialect in UPSERT_INSERTS:
+            return cls.upsert_many_from_records(
+                data, patients, medical_record_id, UPSERT_INSERTS[dialect]
+            )
+
         patients_ext_map = {patient.external_id: patient for patient in patients}
         patients_in_map = {patient.id: patient for patient in patients}
 
@@ -214,16 +252,21 @@ class PatientMedicalRecordService:
         data_map = {(item["p_id"], item["date_admin"]): item for item in data}
 
         print("Updating old records with new data ...")
+        records_found = set()
         records_to_update = {}
         for record in pat_med_records:
             patient = patients_in_map[record.patient_id]
             key = patient.external_id, record.reference_date.strftime("%Y-%m-%d")
             if key in data_map:
-                records_to_update[key] = record.id
+                records_found.add(key)
                 datum = data_map[key]
 
-                if json.dumps(record.data) == json.dumps(datum):
+                digest = record.data_digest or PatientMedicalRecord.get_data_digest(
+                    record.data
+                )
+                if digest == PatientMedicalRecord.get_data_digest(datum):
                     continue
+                records_to_update[key] = record.id
                 record.fill(
                     {
                         "data": datum,
@@ -238,6 +281,7 @@ class PatientMedicalRecordService:
             .where(PatientMedicalRecord.id.in_(records_to_update.values()))
             .values(
                 prediction_state=PatientMedicalRecord.PredictionStates.unknown,
+                prediction_attempts=0,
                 medical_record_id=medical_record_id,
                 actual_state=None,
             )
@@ -245,11 +289,12 @@ class PatientMedicalRecordService:
 
         print("Formatting new records ...")
         data_to_create = [
-            data_map[key] for key in data_map.keys() if key not in records_to_update
+            data_map[key] for key in data_map.keys() if key not in records_found
         ]
         records_to_create = [
             {
                 "data": item,
+                "data_digest": PatientMedicalRecord.get_data_digest(item),
                 "medical_record_id": medical_record_id,
                 "patient_id": patients_ext_map[item["p_id"]].id,
                 "reference_date": item["date_admin"],
@@ -271,6 +316,52 @@ class PatientMedicalRecordService:
 
         # cls.save_records_data(record_ids, data)
 
+    @classmethod
+    def upsert_many_from_records(
+            cls,
+            data: Sequence[dict],
+            patients: Sequence[Patient],
+            medical_record_id: int,
+            dialect_insert: Callable = postgresql.insert,
+    ):
+        patients_ext_map = {patient.external_id: patient for patient in patients}
+        data_map = {(item["p_id"], item["date_admin"]): item for item in data}
+
+        records = [
+            {
+                "data": item,
+                "data_digest": PatientMedicalRecord.get_data_digest(item),
+                "medical_record_id": medical_record_id,
+                "patient_id": patients_ext_map[p_id].id,
+                "reference_date": datetime.strptime(date_admin, "%Y-%m-%d"),
+                "prediction_state": PatientMedicalRecord.PredictionStates.unknown,
+                "actual_state": None,
+            }
+            for (p_id, date_admin), item in data_map.items()
+        ]
+
+        table = PatientMedicalRecord.__table__
+        statement = dialect_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.patient_id, table.c.reference_date],
+            set_={
+                "data": statement.excluded.data,
+                "data_digest": statement.excluded.data_digest,
+                "medical_record_id": statement.excluded.medical_record_id,
+                "prediction_state": statement.excluded.prediction_state,
+                "prediction_attempts": 0,
+                "actual_state": statement.excluded.actual_state,
+                "updated_at": func.now(),
+            },
+            where=table.c.data_digest.is_distinct_from(
+                statement.excluded.data_digest
+            ),
+        )
+
+        print(f"Upserting {len(records)} records ...")
+        for start in range(0, len(records), cls.INSERT_BATCH_SIZE):
+            db.session.execute(statement, records[start:start + cls.INSERT_BATCH_SIZE])
+
     @classmethod
     def save_records_data(cls, record_ids: List[int], data: List[dict]):
         records = PatientMedicalRecord.query.filter(
@@ -281,6 +372,7 @@ class PatientMedicalRecordService:
                 {
                     "data": datum,
                     "prediction_state": PatientMedicalRecord.PredictionStates.unknown,
+                    "prediction_attempts": 0,
                 }
             )
             record.flush()
@@ -0,0 +1,127 @@
+import select
+import time
+from typing import List, Optional, Tuple
+
+from app.core.database import db
+from app.domain.patient.entities.patient import PatientMedicalRecord
+from app.domain.patient.services.patient_medical_record_service import (
+    PatientMedicalRecordService,
+)
+from app.inference.predict import predict_aki
+from config import Config
+
+
+class PredictionService:
+    # Errors predict_aki raises on the records themselves, e.g. a missing or
+    # malformed column. Anything else fails the whole batch and is retried
+    DATA_ERRORS = (ValueError, KeyError)
+
+    @classmethod
+    def predict_next_batch(cls, limit: int) -> Optional[int]:
+        """Predict one claimed batch of unknown records.
+
+        Returns the number of records handled, or None if they could not be stored.
+        """
+        records = PatientMedicalRecord.claim_predictions_unknown(
+            limit, Config.INFERENCE_MAX_PREDICTION_ATTEMPTS
+        )
+        print(f"{len(records)} will be predicted ...")
+
+        if len(records) == 0:
+            db.session.rollback()
+            return 0
+
+        predicted, preds, failed = cls.predict_isolating_failures(records)
+        for record in failed:
+            record.prediction_attempts += 1
+
+        if not PatientMedicalRecordService.update_many_predictions(predicted, preds):
+            # A storage failure is not the records' fault, so nothing is counted
+            return None
+
+        print("Predictions formed")
+        return len(records)
+
+    @classmethod
+    def predict_isolating_failures(
+        cls, records: List[PatientMedicalRecord]
+    ) -> Tuple[List[PatientMedicalRecord], List[dict], List[PatientMedicalRecord]]:
+        """Predict ``records``, halving the batch whenever predict_aki fails on
+        their data so only the records it fails on are left out.
+
+        Returns the predicted records, their predictions and the failed records.
+        """
+        try:
+            return records, predict_aki(records), []
+        except cls.DATA_ERRORS as e:
+            if len(records) == 1:
+                print(f"Prediction of record {records[0].id} failed: {e}")
+                return [], [], records
+
+        middle = len(records) // 2
+        predicted, preds, failed = cls.predict_isolating_failures(records[:middle])
+        rest = cls.predict_isolating_failures(records[middle:])
+        return predicted + rest[0], preds + rest[1], failed + rest[2]
+
+    @classmethod
+    def get_backoff(cls, poll_interval: float, failures: int) -> float:
+        return min(poll_interval * 2 ** (failures - 1), Config.INFERENCE_WORKER_MAX_BACKOFF)
+
+    @classmethod
+    def run_worker(cls, limit: int, poll_interval: float, drain: bool = False):
+        listener = cls._listen()
+        failures = 0
+        try:
+            while True:
+                try:
+                    handled = cls.predict_next_batch(limit)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Prediction failed: {e}")
+                    handled = None
+
+                if handled is None:
+                    failures += 1
+                    backoff = cls.get_backoff(poll_interval, failures)
+                    print(f"Batch failed, retrying in {backoff:g}s ...")
+                    if drain and failures >= Config.INFERENCE_MAX_PREDICTION_ATTEMPTS:
+                        break
+                    # Notifications would wake the worker early, so sleep it off
+                    time.sleep(backoff)
+                    continue
+
+                failures = 0
+                if handled:
+                    continue
+                if drain:
+                    break
+
+                cls._wait(listener, poll_interval)
+        finally:
+            if listener is not None:
+                listener.invalidate()
+
+    @classmethod
+    def _listen(cls):
+        if db.engine.dialect.name != "postgresql":
+            return None
+
+        connection = db.engine.raw_connection()
+        connection.driver_connection.autocommit = True
+        cursor = connection.cursor()
+        cursor.execute(
+            f"LISTEN {PatientMedicalRecordService.PREDICTIONS_CHANNEL}"
+        )
+        cursor.close()
+        return connection
+
+    @classmethod
+    def _wait(cls, listener, timeout: float):
+        if listener is None:
+            time.sleep(timeout)
+            return
+
+        connection = listener.driver_connection
+        if select.select([connection], [], [], timeout)[0]:
+            connection.poll()
+            connection.notifies.clear()
@@ -1,6 +1,6 @@
 import pandas as pd
 import warnings
-from typing import Tuple, Optional
+from typing import List, Tuple, Optional
 
 from app.inference.utils.temporal_data import (
     format_by_temporal_type,
@@ -22,7 +22,7 @@ def convert_to_temporal(
     is_model_light: Optional[bool] = False,
 ) -> Tuple[Tuple[
     pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame
-], pd.DataFrame]:
+], pd.DataFrame, List[str]]:
     (data, data_flag, data_flag2), meta_data = format_by_temporal_type(
         data, data_flag, data_flag2, temporal_type
     )
@@ -39,7 +39,7 @@ def convert_to_temporal(
     ts_others_np, ts_array_col_names2 = mk_binary_dy_temporal(data)
 
     # P_INFO
-    p_info_np = mk_pinfo_temporal(
+    p_info_np, p_info_col_names = mk_pinfo_temporal(
         data,
         [drug_array_col_names, ts_array_col_names, ts_array_col_names2],
         is_model_light,
@@ -47,4 +47,4 @@ def convert_to_temporal(
 
     target_np = data[final_target].values
 
-    return (drug_np, p_info_np, ts_np, ts_others_np, target_np, ts_np_flag), meta_data
+    return (drug_np, p_info_np, ts_np, ts_others_np, target_np, ts_np_flag), meta_data, p_info_col_names
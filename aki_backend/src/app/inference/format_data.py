@@ -1,6 +1,7 @@
+import numpy as np
 import pandas as pd
 import warnings
-from typing import Generator, Tuple
+from typing import Generator, List, Optional, Tuple
 
 from app.inference.utils.fill_data import fill_na, set_stay_length
 from app.inference.utils.dataset import day_by_day_with_past
@@ -11,11 +12,23 @@ warnings.filterwarnings(action="ignore")
 
 def format_data(
     data: pd.DataFrame,
+    batched: bool = False,
+    predicted_days: Optional[List[Optional[int]]] = None,
 ) -> Generator[Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame], None, None]:
+    """``predicted_days`` holds the last predicted day of each input row,
+    earlier windows of that row are skipped.
+    """
     data = set_stay_length(data)
-    data, flag_data = fill_na(data)
+    matrix = fill_na(data)
 
-    data_daily, flag_data_daily = day_by_day_with_past(data, flag_data)
+    if predicted_days is not None:
+        predicted_days = np.array(
+            [-1 if day is None else day for day in predicted_days]
+        )
+
+    data_daily, flag_data_daily = day_by_day_with_past(
+        matrix, batched, predicted_days
+    )
 
     n_days = len(data_daily)
     assert n_days == len(flag_data_daily)
@@ -1,7 +1,6 @@
-import os
-from typing import Tuple
+from contextlib import nullcontext
+from typing import List, Optional, Tuple
 import numpy as np
-import pandas as pd
 import math
 
 import torch
@@ -9,7 +8,12 @@ from torch import nn
 import torch.nn.functional as F
 from torch.utils.data import Dataset
 
-from app.inference.src.lrp_for_model import construct_lrp
+from app.inference.src.lrp import LRP
+from app.inference.src.lrp_for_model import (
+    ActivationRecorder,
+    concat_activations,
+    construct_lrp,
+)
 from app.inference.utils.columns import (
     drug_name,
     ts_name,
@@ -58,6 +62,20 @@ class AKIDataset(Dataset):
             'thresholds': self.thresholds[idx],
         }
 
+    def iter_batches(self, batch_size: int):
+        thresholds = torch.as_tensor(np.asarray(self.thresholds, dtype=float))
+        for start in range(0, len(self), batch_size):
+            batch = slice(start, start + batch_size)
+            yield {
+                'drug': self.x_drug[batch],
+                'info': self.x_info[batch],
+                'timeseries': self.x_ts[batch],
+                'dynamic2': self.x_ts2[batch],
+                'flag': self.x_ts_flag[batch],
+                'labels': torch.zeros(len(thresholds[batch]), dtype=torch.long),
+                'thresholds': thresholds[batch],
+            }
+
 
 def scaled_dot_product_attention(
         query, key, value, attn_mask=None, dropout_p=0.0, is_causal=False, scale=None
@@ -318,6 +336,9 @@ class ResNet(nn.Module):
         return out, reg
 
 
+EXPLAIN_MODES = ("none", "mild", "all")
+
+
 def get_daily_columns(columns: list) -> list:
     return [
         type_ + s
@@ -325,140 +346,139 @@ def get_daily_columns(columns: list) -> list:
         for type_ in ["d1_1_", "d1_2_", "d1_3_", "d2_1_", "d2_2_", "d2_3_"]
     ]
 
-def lrp(device, model, result_folder, test_loader):
-    checkpoint = torch.load(
-        os.path.join(result_folder, f"CNN-best-aki.pt"), map_location=device
-    )
-    model.load_state_dict(checkpoint["model_state_dict"])
-    model = model.eval()
-
-    lrp_model = construct_lrp(model, device)
-
-    def compute_lrp(
-            lrp_model, x_drug, x_info, x_ts, x_ts2, x_ts_flag, y, class_specific
-    ):
-        output = lrp_model.forward(x_drug, x_info, x_ts, x_ts2, x_ts_flag, y, False)
-        drug_relevnace = output["R_drug"]
-        info_relevance = output["R_info"]
-        ts_relevance = output["R_ts"]
-        aki_relevance = output["R_aki"]
-
-        flag_relevance = output["R_flag"]
-        ratio_relevance = output["R_ratio"]
-        return (
-            drug_relevnace,
-            info_relevance,
-            ts_relevance,
-            aki_relevance,
-            flag_relevance,
-            ratio_relevance,
-        )
-
-    lrp_list1 = []
-    lrp_list2 = []
-    lrp_list3 = []
-    lrp_list4 = []
-
-    lrp_list5 = []
-    lrp_list6 = []
-    answers = []
-    predictions = []
-    logits = []
-    for i, batch in enumerate(test_loader):
-        drug, info, ts, ts2, flag, labels, thresholds = (
-            batch["drug"].to(device),
-            batch["info"].to(device),
-            batch["timeseries"].to(device),
-            batch["dynamic2"].to(device),
-            batch["flag"].to(device),
-            batch["labels"].to(device),
-            batch["thresholds"].to(device),
-        )
-        answers.extend(labels[:, 0].detach().cpu().numpy())
-
-        outputs = model(drug, info, ts, ts2, flag)
-
-        answers.extend(labels[:, 0].detach().cpu().numpy())
-
-        cur_logits = torch.sigmoid(outputs[0])
-        logits.extend(cur_logits.detach().cpu().numpy())
 
-        preds_tmp = []
-        preds_tmp.extend((cur_logits > thresholds[..., None]).detach().cpu().numpy())
-        predictions.extend(preds_tmp)
-
-        lrp1, lrp2, lrp3, lrp4, lrp5, lrp6 = compute_lrp(
-            lrp_model, drug, info, ts, ts2, flag, labels, class_specific=False
-        )  # [::-1]
-
-        lrp_list1.extend(lrp1.squeeze(-2).detach().cpu())
-        lrp_list2.extend(lrp2.squeeze((-2, -3)).detach().cpu())
-        lrp_list3.extend(lrp3.detach().cpu())
-        lrp_list4.extend(lrp4.squeeze(-2).detach().cpu())
-        lrp_list5.extend(lrp5.detach().cpu())
-        lrp_list6.extend(lrp6.detach().cpu())
-
-    logits = np.array(logits)
-    predictions = np.array(predictions)
+def get_explanation_columns(info_columns: list) -> list:
+    return (
+        get_daily_columns(drug_name)
+        + info_columns
+        + get_daily_columns(ts_name)
+        + get_daily_columns(dy_others)
+    )
 
-    lrp_list1 = abs(np.array(lrp_list1)).transpose(1, 2, 0)
-    attributions_list = np.vstack(lrp_list1).T
 
-    drug_name_ = get_daily_columns(drug_name)
-    drug_df = pd.DataFrame(attributions_list, columns=drug_name_)
+def get_attributions(relevance: dict) -> np.ndarray:
+    blocks = [
+        relevance["R_drug"].squeeze(-2),
+        relevance["R_info"].squeeze((-2, -3)),
+        relevance["R_ts"][:, :, 0, :],
+        relevance["R_aki"].squeeze(-2),
+    ]
+    return np.hstack(
+        [abs(block.detach().cpu().numpy()).reshape(len(block), -1) for block in blocks]
+    )
 
-    lrp_list2 = abs(np.array(lrp_list2))
-    p_info_df = pd.DataFrame(lrp_list2, columns=others)
 
-    lrp_list3 = abs(np.array(lrp_list3))[:, :, 0, :].transpose(1, 2, 0)
-    attributions_list = np.vstack(lrp_list3).T
-    ts_name_ = get_daily_columns(ts_name)
-    ts_df = pd.DataFrame(attributions_list, columns=ts_name_)
+def get_top_attributions(
+    attributions: np.ndarray, columns: list, k: Optional[int] = None
+) -> List[list]:
+    """The ``k`` largest attributions of every row as [column, score] pairs,
+    largest first."""
+    k = attributions.shape[1] if k is None else min(k, attributions.shape[1])
+    if k == 0:
+        return [[] for _ in range(len(attributions))]
 
-    lrp_list4 = abs(np.array(lrp_list4)).transpose(1, 2, 0)
-    attributions_list = np.vstack(lrp_list4).T
-    dyothers_name_ = get_daily_columns(dy_others)
-    ts2_df = pd.DataFrame(attributions_list, columns=dyothers_name_)
+    top = np.argpartition(-attributions, k - 1, axis=1)[:, :k]
+    scores = np.take_along_axis(attributions, top, axis=1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    top = np.take_along_axis(top, order, axis=1)
+    scores = np.take_along_axis(scores, order, axis=1)
 
-    attributions = pd.concat((drug_df, p_info_df, ts2_df, ts_df), axis=1)
-    return logits, predictions, attributions
+    return [
+        [[columns[i], score] for i, score in zip(row_top, row_scores.tolist())]
+        for row_top, row_scores in zip(top, scores)
+    ]
 
 
-def predict(device, model, result_folder, test_loader) -> Tuple[np.ndarray, np.ndarray, pd.DataFrame]:
-    checkpoint = torch.load(
-        os.path.join(result_folder, f"CNN-best-aki.pt"), map_location=device
-    )
-    model.load_state_dict(checkpoint["model_state_dict"])
-    model = model.eval()
+def get_explained_rows(predictions: torch.Tensor, explain: str) -> torch.Tensor:
+    if explain == "all":
+        return torch.arange(len(predictions), device=predictions.device)
+    if explain == "mild":
+        return torch.nonzero(predictions[:, 0]).squeeze(-1)
+    return torch.arange(0, device=predictions.device)
+
+
+def lrp(
+    device,
+    model,
+    test_loader,
+    info_columns: list = others,
+    top_k: Optional[int] = None,
+):
+    return predict(device, model, test_loader, "all", info_columns, top_k=top_k)
+
+
+def predict(
+    device,
+    model,
+    test_loader,
+    explain: str = "none",
+    info_columns: list = others,
+    lrp_model: Optional[LRP] = None,
+    top_k: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray, List[Optional[list]]]:
+    """Predict ``test_loader``, explaining the rows selected by ``explain``
+    with their ``top_k`` attributions, or all of them if None.
+    """
+    if explain not in EXPLAIN_MODES:
+        raise ValueError(f"Invalid explain mode {explain}")
 
     predictions = []
     logits = []
-    for i, batch in enumerate(test_loader):
-        drug, info, ts, ts2, flag, labels, thresholds = (
-            batch["drug"].to(device),
-            batch["info"].to(device),
-            batch["timeseries"].to(device),
-            batch["dynamic2"].to(device),
-            batch["flag"].to(device),
-            batch["labels"].to(device),
-            batch["thresholds"].to(device),
-        )
-
-        outputs = model(drug, info, ts, ts2, flag)
-
-        cur_logits = torch.sigmoid(outputs[0])
-        logits.extend(cur_logits.detach().cpu().numpy())
-
-        preds_tmp = []
-        preds_tmp.extend((cur_logits > thresholds[..., None]).detach().cpu().numpy())
-        predictions.extend(preds_tmp)
+    activations = []
+    explained_rows = []
+    # Relevance reuses the activations of the prediction pass
+    if explain == "none":
+        lrp_model = None
+    elif lrp_model is None:
+        lrp_model = construct_lrp(model, device)
+    recorder = (
+        ActivationRecorder(lrp_model.graph.modules())
+        if lrp_model is not None
+        else nullcontext()
+    )
+    with recorder:
+        for i, batch in enumerate(test_loader):
+            drug, info, ts, ts2, flag, labels, thresholds = (
+                batch["drug"].to(device),
+                batch["info"].to(device),
+                batch["timeseries"].to(device),
+                batch["dynamic2"].to(device),
+                batch["flag"].to(device),
+                batch["labels"].to(device),
+                batch["thresholds"].to(device),
+            )
+
+            outputs = model(drug, info, ts, ts2, flag)
+
+            cur_logits = torch.sigmoid(outputs[0])
+            cur_preds = cur_logits > thresholds[..., None]
+
+            if explain != "none":
+                rows = get_explained_rows(cur_preds, explain)
+                if len(rows) > 0:
+                    activations.append(recorder.get_activations(rows))
+                    explained_rows.append(rows.cpu().numpy() + len(predictions))
+                recorder.clear()
+
+            logits.extend(cur_logits.detach().cpu().numpy())
+            predictions.extend(cur_preds.detach().cpu().numpy())
 
     logits = np.array(logits)
     predictions = np.array(predictions)
 
-    all_exp_columns = get_daily_columns(drug_name) + others + get_daily_columns(ts_name) + get_daily_columns(dy_others)
-    attributions = np.empty((len(predictions), len(all_exp_columns)), dtype=float)
-    attributions.fill(np.nan)
-    explanations = pd.DataFrame(attributions, columns=all_exp_columns)
+    explanations = [None] * len(predictions)
+    if len(activations) > 0:
+        # One relevance sweep over every explained row of every batch
+        relevance = lrp_model.relevance(concat_activations(activations))
+        attributions = get_attributions(relevance)
+        top_attributions = get_top_attributions(
+            attributions, get_explanation_columns(info_columns), top_k
+        )
+        # Rows with undefined attributions are left unexplained
+        is_valid = ~np.isnan(attributions).any(axis=1)
+        for row, pairs, valid in zip(
+            np.concatenate(explained_rows), top_attributions, is_valid
+        ):
+            explanations[row] = pairs if valid else None
 
     return logits, predictions, explanations
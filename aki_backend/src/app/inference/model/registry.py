@@ -0,0 +1,206 @@
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from app.inference.model.AKImodel import ResNet
+from app.inference.model.scaler import compile_scalers
+from app.inference.src.lrp import LRP
+from app.inference.src.lrp_for_model import (
+    construct_lrp,
+    get_lrp_rules_tag,
+    get_lrp_weights,
+)
+from app.inference.utils.pickle_loader import pickle_load
+
+CHECKPOINT_FILENAME = "CNN-best-aki.pt"
+SCALER_PREFIX = "scaler"
+SCALER_EXT = ".pickle"
+COMPILED_SCALERS_FILENAME = "scalers.npz"
+LRP_FILENAME = "CNN-best-aki.lrp.pt"
+
+
+class ResultArtifacts:
+    def __init__(self, result_dir: str, signature: Tuple[Tuple[str, int], ...]):
+        self.result_dir = result_dir
+        self.signature = signature
+
+        self.scalers: Optional[Dict[str, object]] = None
+        self.compiled_scalers: Optional[Dict[str, np.ndarray]] = None
+        self.state_dict: Optional[dict] = None
+        self.models: Dict[Tuple[Tuple[int, ...], str], ResNet] = {}
+        self.lrp_weights: Optional[Dict[str, torch.Tensor]] = None
+        self.lrp_models: Dict[Tuple[Tuple[int, ...], str], LRP] = {}
+
+    @property
+    def checkpoint_path(self) -> str:
+        return os.path.join(self.result_dir, CHECKPOINT_FILENAME)
+
+    def load_scalers(self) -> Dict[str, object]:
+        if self.scalers is None:
+            self.scalers = {
+                filename[: -len(SCALER_EXT)]: pickle_load(
+                    os.path.join(self.result_dir, filename)
+                )
+                for filename, _ in self.signature
+                if filename.startswith(SCALER_PREFIX)
+            }
+        return self.scalers
+
+    @property
+    def compiled_scalers_path(self) -> str:
+        return os.path.join(self.result_dir, COMPILED_SCALERS_FILENAME)
+
+    def load_compiled_scalers(self) -> Dict[str, np.ndarray]:
+        if self.compiled_scalers is not None:
+            return self.compiled_scalers
+
+        path = self.compiled_scalers_path
+        latest_mtime = max(
+            (mtime for filename, mtime in self.signature
+             if filename.startswith(SCALER_PREFIX)),
+            default=0,
+        )
+        if os.path.exists(path) and os.stat(path).st_mtime_ns >= latest_mtime:
+            with np.load(path) as compiled:
+                self.compiled_scalers = dict(compiled)
+            return self.compiled_scalers
+
+        self.compiled_scalers = compile_scalers(self.load_scalers())
+        try:
+            np.savez(path, **self.compiled_scalers)
+        except OSError as e:
+            print(f"Could not cache compiled scalers to {path}: {e}")
+        return self.compiled_scalers
+
+    def load_state_dict(self) -> dict:
+        if self.state_dict is None:
+            checkpoint = torch.load(self.checkpoint_path, map_location="cpu")
+            self.state_dict = checkpoint["model_state_dict"]
+        return self.state_dict
+
+    def load_model(self, input_size: Sequence[int], device: str) -> ResNet:
+        key = (tuple(input_size), str(device))
+        if key not in self.models:
+            model = ResNet(input_size=list(input_size), classes=1)
+            model.load_state_dict(self.load_state_dict())
+            self.models[key] = model.to(device).eval()
+        return self.models[key]
+
+    @property
+    def lrp_path(self) -> str:
+        return os.path.join(self.result_dir, LRP_FILENAME)
+
+    def get_checkpoint_signature(self) -> List:
+        stat = os.stat(self.checkpoint_path)
+        return [CHECKPOINT_FILENAME, stat.st_size, stat.st_mtime_ns]
+
+    def load_lrp_weights(self, rules_tag: str) -> Optional[Dict[str, torch.Tensor]]:
+        if self.lrp_weights is not None:
+            return self.lrp_weights
+
+        # Weights of another checkpoint or of other rules are rebuilt, whatever
+        # the modification times of the files
+        path = self.lrp_path
+        if os.path.exists(path):
+            saved = torch.load(path, map_location="cpu")
+            if (
+                isinstance(saved, dict)
+                and saved.get("checkpoint") == self.get_checkpoint_signature()
+                and saved.get("rules") == rules_tag
+            ):
+                self.lrp_weights = saved["weights"]
+        return self.lrp_weights
+
+    def load_lrp(self, input_size: Sequence[int], device: str) -> LRP:
+        key = (tuple(input_size), str(device))
+        if key not in self.lrp_models:
+            model = self.load_model(input_size, device)
+            rules_tag = get_lrp_rules_tag(model)
+            lrp_model = construct_lrp(model, device, self.load_lrp_weights(rules_tag))
+
+            if self.lrp_weights is None:
+                self.lrp_weights = get_lrp_weights(lrp_model, model)
+                saved = {
+                    "checkpoint": self.get_checkpoint_signature(),
+                    "rules": rules_tag,
+                    "weights": self.lrp_weights,
+                }
+                try:
+                    torch.save(saved, self.lrp_path)
+                except OSError as e:
+                    print(f"Could not cache LRP weights to {self.lrp_path}: {e}")
+            self.lrp_models[key] = lrp_model
+        return self.lrp_models[key]
+
+
+class ModelRegistry:
+    """Process-wide cache of model weights, LRP models and scalers keyed by result dir.
+
+    Files are re-read only when their modification time changes.
+    """
+
+    def __init__(self):
+        self._artifacts: Dict[str, ResultArtifacts] = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def get_signature(result_dir: str) -> Tuple[Tuple[str, int], ...]:
+        return tuple(
+            sorted(
+                (entry.name, entry.stat().st_mtime_ns)
+                for entry in os.scandir(result_dir)
+                if entry.is_file()
+                and (
+                    entry.name == CHECKPOINT_FILENAME
+                    or (
+                        entry.name.startswith(SCALER_PREFIX)
+                        and entry.name.endswith(SCALER_EXT)
+                    )
+                )
+            )
+        )
+
+    def get(self, result_dir: str) -> ResultArtifacts:
+        result_dir = os.path.abspath(result_dir)
+        signature = self.get_signature(result_dir)
+
+        with self._lock:
+            artifacts = self._artifacts.get(result_dir)
+            if artifacts is None or artifacts.signature != signature:
+                if artifacts is not None:
+                    print(f"Reloading inference artifacts from {result_dir} ...")
+                artifacts = ResultArtifacts(result_dir, signature)
+                self._artifacts[result_dir] = artifacts
+            return artifacts
+
+    def get_scalers(self, result_dir: str) -> Dict[str, object]:
+        artifacts = self.get(result_dir)
+        with self._lock:
+            return artifacts.load_scalers()
+
+    def get_compiled_scalers(self, result_dir: str) -> Dict[str, np.ndarray]:
+        artifacts = self.get(result_dir)
+        with self._lock:
+            return artifacts.load_compiled_scalers()
+
+    def get_model(
+        self, result_dir: str, input_size: Sequence[int], device: str
+    ) -> ResNet:
+        artifacts = self.get(result_dir)
+        with self._lock:
+            return artifacts.load_model(input_size, device)
+
+    def get_lrp(self, result_dir: str, input_size: Sequence[int], device: str) -> LRP:
+        artifacts = self.get(result_dir)
+        with self._lock:
+            return artifacts.load_lrp(input_size, device)
+
+    def clear(self):
+        with self._lock:
+            self._artifacts.clear()
+
+
+model_registry = ModelRegistry()
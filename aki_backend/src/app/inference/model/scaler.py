@@ -0,0 +1,73 @@
+from typing import Dict, Tuple
+
+import numpy as np
+from sklearn.preprocessing import MinMaxScaler, StandardScaler
+
+SCALER_BLOCKS = ("drug", "info", "ts", "ts2", "flag")
+
+
+def get_affine(scaler) -> Tuple[np.ndarray, np.ndarray]:
+    if isinstance(scaler, MinMaxScaler):
+        if scaler.clip:
+            raise ValueError("Clipping MinMaxScaler cannot be fused")
+        return scaler.scale_, scaler.min_
+
+    if isinstance(scaler, StandardScaler):
+        n_features = scaler.n_features_in_
+        mean = scaler.mean_ if scaler.with_mean else np.zeros(n_features)
+        std = scaler.scale_ if scaler.with_std else np.ones(n_features)
+        return 1 / std, -mean / std
+
+    raise ValueError(f"Unsupported scaler type: {type(scaler).__name__}")
+
+
+def stack_affine(
+    scalers: Dict[str, object], prefix: str, shape: Tuple[int, ...]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Stack per-slice scalers into arrays matching the trailing data axes.
+
+    ``shape`` holds the number of slices per trailing axis, the scaler for
+    slice ``(j, i)`` being named ``{prefix}_{i}_{j}``.
+    """
+    scale, offset = None, None
+    for position in np.ndindex(*shape):
+        name = "_".join([prefix, *map(str, reversed(position))])
+        sc_scale, sc_offset = get_affine(scalers[name])
+        if scale is None:
+            scale = np.empty((len(sc_scale), *shape))
+            offset = np.empty((len(sc_offset), *shape))
+        scale[(slice(None), *position)] = sc_scale
+        offset[(slice(None), *position)] = sc_offset
+    return scale, offset
+
+
+def compile_scalers(scalers: Dict[str, object]) -> Dict[str, np.ndarray]:
+    n_drug = sum(name.startswith("scaler0_") for name in scalers)
+    n_ts2 = sum(name.startswith("scaler3_") for name in scalers)
+    n_ts = sum(name.startswith("scaler2_") for name in scalers)
+    n_flag = sum(name.startswith("scaler_flag_") for name in scalers)
+
+    ts_types = n_ts // n_drug
+    flag_types = n_flag // n_drug
+
+    blocks = {
+        "drug": stack_affine(scalers, "scaler0", (n_drug,)),
+        "info": get_affine(scalers["scaler1"]),
+        "ts": stack_affine(scalers, "scaler2", (ts_types, n_drug)),
+        "ts2": stack_affine(scalers, "scaler3", (n_ts2,)),
+        "flag": stack_affine(scalers, "scaler_flag", (flag_types, n_drug)),
+    }
+
+    compiled = {}
+    for name, (scale, offset) in blocks.items():
+        compiled[f"{name}_scale"] = np.asarray(scale, dtype=np.float64)
+        compiled[f"{name}_offset"] = np.asarray(offset, dtype=np.float64)
+    return compiled
+
+
+def apply_affine(data: np.ndarray, scale: np.ndarray, offset: np.ndarray):
+    if not np.issubdtype(data.dtype, np.floating):
+        data = data.astype(np.float64)
+    data *= scale
+    data += offset
+    return data
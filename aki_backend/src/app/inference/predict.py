@@ -1,9 +1,14 @@
 import os
+import atexit
+import multiprocessing
 from collections import defaultdict
-from typing import List, Dict, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, List, Dict, Optional, Tuple
 
 import pandas as pd
 import numpy as np
+import torch
 
 from app import app
 
@@ -13,6 +18,8 @@ from app.inference.test import predict_and_explain
 from app.inference.format_data import format_data
 from app.inference.convert_to_temporal import convert_to_temporal
 
+shard_executor: Optional[ProcessPoolExecutor] = None
+
 
 def df_from_patient_medical_records(
     records: List[PatientMedicalRecord],
@@ -20,18 +27,27 @@ def df_from_patient_medical_records(
     return pd.DataFrame.from_records([record.data for record in records])
 
 
+def stack_temporal_data(
+    converted: List[Tuple[Tuple[np.ndarray, ...], pd.DataFrame, List[str]]],
+) -> Tuple[List[np.ndarray], pd.DataFrame]:
+    data = [
+        np.concatenate([np.asarray(arrays[i]) for arrays, _, _ in converted])
+        for i in range(len(converted[0][0]))
+    ]
+    meta_data = pd.concat([meta for _, meta, _ in converted])
+
+    return data, meta_data
+
+
 def process_data_by_type(
-    data: pd.DataFrame,
-    flag_data: pd.DataFrame,
-    flag_data2: pd.DataFrame,
+    converted: List[Tuple[Tuple[np.ndarray, ...], pd.DataFrame, List[str]]],
     temporal_type: str,
     thresholds: Dict[str, float],
     is_model_light: bool,
-) -> Tuple[np.ndarray, np.ndarray, pd.DataFrame, pd.DataFrame, np.ndarray]:
-    data, meta_data = convert_to_temporal(
-        data, flag_data, flag_data2, temporal_type, is_model_light
-    )
-    data = list(data)
+    explain: str,
+) -> Tuple[np.ndarray, np.ndarray, List[Optional[list]], pd.DataFrame, np.ndarray]:
+    data, meta_data = stack_temporal_data(converted)
+    info_columns = converted[0][2]
 
     work_dir = os.path.join(
         app.config["INFERENCE_DATA_DIR"],
@@ -40,9 +56,9 @@ def process_data_by_type(
 
     thresholds = meta_data["department"].apply(lambda x: thresholds.get(x, 0.5)).values
     logits, predictions, explanations = (
-        predict_and_explain(data, work_dir, thresholds)
+        predict_and_explain(data, work_dir, thresholds, explain, info_columns)
         if len(data[0]) > 0
-        else (np.array([]), np.array([]), pd.DataFrame([]))
+        else (np.array([]), np.array([]), [])
     )
 
     return logits, predictions, explanations, meta_data, thresholds
@@ -50,10 +66,103 @@ def process_data_by_type(
 def prior_predicted_days(records: List[PatientMedicalRecord]) -> List[int]:
     return [record.max_predicted_day for record in records]
 
-def predict_aki(records: List[PatientMedicalRecord]):
+def init_shard_worker(n_threads: int, config: Dict[str, Any]):
+    torch.set_num_threads(n_threads)
+    app.config.update(config)
+
+
+def get_shard_executor() -> ProcessPoolExecutor:
+    global shard_executor
+    if shard_executor is None:
+        n_workers = app.config["INFERENCE_WORKERS"]
+        n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+        config = {
+            key: value for key, value in app.config.items()
+            if key.startswith("INFERENCE_")
+        }
+        shard_executor = ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_shard_worker,
+            initargs=(n_threads, config),
+        )
+    return shard_executor
+
+
+@atexit.register
+def shutdown_shard_executor(wait: bool = True):
+    global shard_executor
+    if shard_executor is not None:
+        shard_executor.shutdown(wait=wait, cancel_futures=True)
+        shard_executor = None
+
+
+def predict_shard(
+    input_df: pd.DataFrame,
+    predicted_days: List[int],
+    thresholds_pool: Dict[str, Dict[str, float]],
+    explain: str,
+) -> List[dict]:
+    with app.app_context():
+        return predict_aki_from_data(
+            input_df, predicted_days, thresholds_pool, explain
+        )
+
+
+def predict_aki(records: List[PatientMedicalRecord], explain: Optional[str] = None):
+    """Predict ``records``, explaining the rows selected by ``explain``.
+
+    ``explain`` is one of "none", "mild" or "all" and defaults to
+    ``INFERENCE_EXPLAIN``.
+    """
     input_df = df_from_patient_medical_records(records)
     predicted_days = prior_predicted_days(records)
+    thresholds_pool = Department.get_inference_thresholds()
+    explain = explain or app.config["INFERENCE_EXPLAIN"]
+
+    n_workers = app.config["INFERENCE_WORKERS"]
+    if len(input_df) > 0:
+        n_workers = min(n_workers, input_df["p_id"].nunique())
+    if n_workers <= 1:
+        return predict_aki_from_data(
+            input_df, predicted_days, thresholds_pool, explain
+        )
+
+    # Every record of a patient lands in the same shard
+    shards = pd.factorize(input_df["p_id"])[0] % n_workers
+    positions = [np.flatnonzero(shards == i) for i in range(n_workers)]
+
+    results = [None] * len(input_df)
+    try:
+        executor = get_shard_executor()
+        futures = [
+            executor.submit(
+                predict_shard,
+                input_df.iloc[shard_positions].reset_index(drop=True),
+                [predicted_days[i] for i in shard_positions],
+                thresholds_pool,
+                explain,
+            )
+            for shard_positions in positions
+        ]
+        for shard_positions, future in zip(positions, futures):
+            for i, result in zip(shard_positions, future.result()):
+                results[i] = result
+    except BrokenProcessPool:
+        # A crashed shard worker breaks the pool for good, so the next batch
+        # starts a fresh one
+        shutdown_shard_executor(wait=False)
+        raise
+
+    return results
+
 
+def predict_aki_from_data(
+    input_df: pd.DataFrame,
+    predicted_days: List[int],
+    thresholds_pool: Dict[str, Dict[str, float]],
+    explain: str = "none",
+) -> List[dict]:
     input_len = len(input_df)
 
     def get_pred_template():
@@ -64,46 +173,49 @@ def predict_aki(records: List[PatientMedicalRecord]):
     all_explanations = get_pred_template()
     all_thresholds = get_pred_template()
 
-    data = format_data(input_df.copy())
-
-    thresholds_pool = Department.get_inference_thresholds()
+    # Windows up to each record's last predicted day are never built
+    data = format_data(
+        input_df.copy(), app.config["INFERENCE_BATCH_DAY_WINDOWS"], predicted_days
+    )
 
+    # Every day window of a model variant goes through a single inference
+    converted_by_type = defaultdict(list)
     for day_datum_acc in data:
         datum, flag_data, flag_data2 = day_datum_acc
         for is_model_light in [False]:
             for temporal_type in [TemporalType.freq, TemporalType.rare]:
                 temporal_type = temporal_type.value
-
-                logits, predictions, explanations, meta_data, thresholds = (
-                    process_data_by_type(
-                        datum,
-                        flag_data,
-                        flag_data2,
-                        temporal_type,
-                        thresholds_pool[temporal_type],
-                        is_model_light,
+                converted_by_type[(temporal_type, is_model_light)].append(
+                    convert_to_temporal(
+                        datum, flag_data, flag_data2, temporal_type, is_model_light
                     )
                 )
 
-                explanations = explanations.to_dict("records")
-
-                has_na_vals = lambda x: any(map(lambda y: pd.isna(y), x.values()))
+    for (temporal_type, is_model_light), converted in converted_by_type.items():
+        logits, predictions, explanations, meta_data, thresholds = (
+            process_data_by_type(
+                converted,
+                temporal_type,
+                thresholds_pool[temporal_type],
+                is_model_light,
+                explain,
+            )
+        )
 
-                for pred_i, data_i in enumerate(meta_data.index):
-                    day = int(meta_data.iloc[pred_i]["day"])
-                    if predicted_days[data_i] is not None and day <= predicted_days[data_i]:
-                        continue
+        for pred_i, data_i in enumerate(meta_data["p_id2"].astype(int)):
+            day = int(meta_data.iloc[pred_i]["day"])
 
-                    if not np.isnan(logits[pred_i]):
-                        all_logits[data_i][day] = logits[pred_i].item()
+            if not np.isnan(logits[pred_i]):
+                all_logits[data_i][day] = logits[pred_i].item()
 
-                    if not np.isnan(predictions[pred_i]):
-                        all_predictions[data_i][day] = predictions[pred_i].item()
+            if not np.isnan(predictions[pred_i]):
+                all_predictions[data_i][day] = predictions[pred_i].item()
 
-                    if not has_na_vals(explanations[pred_i]):
-                        all_explanations[data_i][day] = explanations[pred_i]
+            # Top attributions as [column, score] pairs, largest first
+            if explanations[pred_i] is not None:
+                all_explanations[data_i][day] = explanations[pred_i]
 
-                    all_thresholds[data_i][day] = thresholds[pred_i]
+            all_thresholds[data_i][day] = thresholds[pred_i]
 
     results = [
         {
@@ -1,5 +1,7 @@
+import os
+import shutil
 import warnings
-from typing import Tuple, List
+from typing import Generator, List, Optional, Set
 
 import numpy as np
 import pandas as pd
@@ -8,47 +10,142 @@ from pandas import DataFrame
 
 from app.inference.utils.columns import static_e
 
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
 warnings.filterwarnings(action="ignore")
 
 random_seed = 10
 np.random.seed(random_seed)
 
 
-def preprocess_file(
-    filepath: str, department_ids: List[str]
-) -> DataFrame:
-    # data = pd.read_csv(filepath, encoding='euc-kr')  # encoding='CP949'
-    data = pd.read_csv(filepath)
+CSV_DTYPES = {
+    "p_id": str,
+    "department": str,
+    "date_admin": str,
+    "date_now": str,
+    "date_discharge": str,
+}
 
-    print("Original Data Length: ", len(data))
-    data = data.dropna(how="any", subset=static_e).reset_index(drop=True)
-    print("After filter by nans in static columns: ", len(data))
 
+def filter_chunk(data: DataFrame) -> DataFrame:
+    data = data.dropna(how="any", subset=static_e)
     data = data.loc[data["age"] > 18]
-    print("After filter by age less than 18: ", len(data))
 
-    data["year"] = data["date_admin"].apply(lambda x: x.split("-")[0])
-    data["month"] = data["date_admin"].apply(lambda x: x.split("-")[1])
-    data = data.loc[data["year"].astype(int) > 2018].reset_index(drop=True)
-    print("After filter by year less than 2018: ", len(data))
+    date_parts = data["date_admin"].str.split("-")
+    data["year"] = date_parts.str[0]
+    data["month"] = date_parts.str[1]
+    data = data.loc[data["year"].astype(int) > 2018]
 
-    data = data.loc[data["department"].isin(set(department_ids))].reset_index(drop=True)
-    print("After filter by department: ", len(data))
     data["stay_length"] = data["stay_length"].clip(upper=9)
 
-    # Transform NaN to None
-    print("Filling na. ...")
-    data.fillna(np.nan, inplace=True)
-    print("Preprocressed len: ", len(data))
+    return data
 
-    print("Replacing na. ...")
-    data.replace(np.nan, None, inplace=True)
-    print("Preprocressed len: ", len(data))
 
-    print("Resetting index ...")
+def select_departments(data: DataFrame, department_ids: Set[str]) -> DataFrame:
+    data = data.loc[data["department"].isin(department_ids)]
+
+    # Transform NaN to None
+    data = data.replace(np.nan, None)
     data.reset_index(drop=True, inplace=True)
-    print("Preprocressed len: ", len(data))
 
     data["p_id"] = data["p_id"].astype(str)
 
     return data
+
+
+def read_csv_chunks(
+    filepath: str, chunksize: int, cache_path: Optional[str] = None
+) -> Generator[DataFrame, None, None]:
+    """Filtered CSV chunks, also written as parquet parts to ``cache_path``."""
+    if pq is None:
+        cache_path = None
+
+    tmp_path = None
+    if cache_path is not None:
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+
+    try:
+        reader = pd.read_csv(filepath, dtype=CSV_DTYPES, chunksize=chunksize)
+        for i, chunk in enumerate(reader):
+            chunk = filter_chunk(chunk)
+            if tmp_path is not None:
+                chunk.to_parquet(
+                    os.path.join(tmp_path, f"part-{i:05d}.parquet"), index=False
+                )
+            yield chunk
+
+        if tmp_path is not None and not os.path.exists(cache_path):
+            try:
+                os.replace(tmp_path, cache_path)
+                tmp_path = None
+            except OSError:
+                # Another process published the same cache first
+                pass
+    finally:
+        if tmp_path is not None:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def read_cached_chunks(
+    cache_path: str, columns: Optional[List[str]] = None
+) -> Generator[DataFrame, None, None]:
+    for filename in sorted(os.listdir(cache_path)):
+        table = pq.read_table(
+            os.path.join(cache_path, filename), columns=columns, memory_map=True
+        )
+        yield table.to_pandas()
+
+
+def preprocess_file_chunks(
+    filepath: str,
+    department_ids: List[str],
+    chunksize: int = 1000,
+    cache_path: Optional[str] = None,
+    columns: Optional[List[str]] = None,
+) -> Generator[DataFrame, None, None]:
+    department_ids = set(department_ids)
+    if columns is not None:
+        columns = list(dict.fromkeys(["p_id", "department", *columns]))
+
+    if pq is not None and cache_path is not None and os.path.isdir(cache_path):
+        print(f"Reading cached file {cache_path} ...")
+        chunks = read_cached_chunks(cache_path, columns)
+    else:
+        chunks = read_csv_chunks(filepath, chunksize, cache_path)
+
+    n_read, n_kept = 0, 0
+    for chunk in chunks:
+        n_read += len(chunk)
+        chunk = select_departments(chunk, department_ids)
+        if columns is not None:
+            chunk = chunk[columns]
+        n_kept += len(chunk)
+
+        print(f"Preprocessed {n_kept} of {n_read} filtered rows ...")
+        if len(chunk) > 0:
+            yield chunk
+
+
+def preprocess_file(
+    filepath: str,
+    department_ids: List[str],
+    chunksize: int = 1000,
+    cache_path: Optional[str] = None,
+    columns: Optional[List[str]] = None,
+) -> DataFrame:
+    chunks = list(
+        preprocess_file_chunks(filepath, department_ids, chunksize, cache_path, columns)
+    )
+    if len(chunks) == 0:
+        if columns is not None:
+            return DataFrame(columns=columns)
+        return pd.read_csv(filepath, dtype=CSV_DTYPES, nrows=0)
+
+    data = pd.concat(chunks, ignore_index=True)
+    print("Preprocressed len: ", len(data))
+
+    return data
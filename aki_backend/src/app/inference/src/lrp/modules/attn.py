@@ -24,6 +24,11 @@ class AttnLrp(nn.Module):
 
         return output, attention_weights
 
+    def lrp_value(self, R, attention_weights):
+        """Relevance of the value matrix alone, conserving ``R``."""
+        R_V = torch.matmul(attention_weights.transpose(-1, -2), R)
+        return R_V * (R.sum() / R_V.sum())
+
     def lrp(self, R, Q, K, V, attention_weights):
         # Propagate relevance through the value matrix
         R_V = torch.matmul(attention_weights.transpose(-1, -2), R)
@@ -1,32 +1,29 @@
 import torch 
 import torch.nn as nn
-from .utils import construct_incr, construct_rho, clone_layer, keep_conservative
+import torch.nn.functional as F
+from .utils import construct_incr, construct_rho
 
 class Conv2dLrp(nn.Module):
-    def __init__(self, layer, rule):
+    def __init__(self, layer, rule, weight=None):
         super().__init__()
-        self.layer = clone_layer(layer)
         self.rho = construct_rho(**rule)
         self.incr = construct_incr(**rule)
 
-        self.layer.weight = self.rho(self.layer.weight)
-        self.layer.bias = keep_conservative(self.layer.bias)
+        # The bias is zeroed, so only the rule-transformed weight is kept
+        if weight is None:
+            weight = self.rho(layer.weight)
+        self.register_buffer("weight", weight.detach())
+        self.conv_args = (layer.stride, layer.padding, layer.dilation, layer.groups)
         self.mask = None  
         # ACtion -> Convolution -> [Activation]
         # Relevance   <- (weight) <- [Relevance]
     def forward(self, Rj, Ai, Ai_2=None):
-        Ai = torch.autograd.Variable(Ai, requires_grad=True)
+        # Bias is zeroed, so the gradient of Z * S is the transposed convolution of S
+        Z = self.incr(F.conv2d(Ai, self.weight, None, *self.conv_args))
+        S = Rj / Z
+        Ci = torch.nn.grad.conv2d_input(Ai.shape, self.weight, S, *self.conv_args)
 
-        Ai.retain_grad()
-
-        Z = self.layer.forward(Ai)
-        Z = self.incr(Z)
-        #print("inner: ",Ai.shape, Z.shape)
-        S = (Rj / Z).data 
-        (Z * S).sum().backward()
-        Ci = Ai.grad
-
-        Ri = (Ai * Ci).data
+        Ri = Ai * Ci
         if self.mask:
             Ri[:,self.mask,:,:] = 0
         # Normalize to ensure relevance conservation
@@ -39,7 +36,7 @@ class Conv2dLrp(nn.Module):
         # masking all other filters of the selected concept_ids
         if concept_ids:
             self.mask = list(
-                            set(range(self.layer.weight.size(1))) - set(concept_ids)
+                            set(range(self.weight.size(1))) - set(concept_ids)
                         )
 
     def remove_concept_mask(self):
@@ -1,29 +1,26 @@
 import torch 
 import torch.nn as nn 
-from .utils import construct_incr, construct_rho, clone_layer, keep_conservative
+import torch.nn.functional as F
+from .utils import construct_incr, construct_rho
 
 class LinearLrp(nn.Module):
-    def __init__(self, layer, rule):
+    def __init__(self, layer, rule, weight=None):
         super().__init__()
 
-        self.layer = clone_layer(layer)
         self.rho = construct_rho(**rule)
         self.incr = construct_incr(**rule)
 
-        self.layer.weight = self.rho(self.layer.weight)
-        self.layer.bias = keep_conservative(self.layer.bias)
+        # The bias is zeroed, so only the rule-transformed weight is kept
+        if weight is None:
+            weight = self.rho(layer.weight)
+        self.register_buffer("weight", weight.detach())
 
     def forward(self, Rj, Ai):
-        
-        Ai = torch.autograd.Variable(Ai, requires_grad=True)
-        Ai.retain_grad()
-        Z = self.layer.forward(Ai)
-        Z = self.incr(Z)
-        S = (Rj / Z).data 
-        (Z * S).sum().backward()
-        Ci = Ai.grad 
-        
-        Ri = (Ai * Ci).data
+        Z = self.incr(F.linear(Ai, self.weight))
+        S = Rj / Z
+        Ci = S @ self.weight
+
+        Ri = Ai * Ci
         #Ri /= (Ri.sum() + 1e-7)
         return  Ri
 
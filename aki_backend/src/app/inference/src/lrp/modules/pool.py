@@ -2,6 +2,7 @@ import torch
 import torch.nn as nn
 from torch.autograd import Variable
 import torch.nn.functional as F
+from torch.nn.modules.utils import _pair
 from .utils import construct_incr, clone_layer
 
 
@@ -10,20 +11,25 @@ class AvgPoolLrp(nn.Module):
         super().__init__()
 
         rule = {k: v for k, v in rule.items() if k == "epsilon"}  # only epsilon rule is possible
-        self.layer = clone_layer(layer)
         self.incr = construct_incr(**rule)
 
+        kernel_size = _pair(layer.kernel_size)
+        stride = _pair(layer.stride or layer.kernel_size)
+        if kernel_size != stride or _pair(layer.padding) != (0, 0):
+            raise ValueError("Only non-overlapping average pooling is supported")
+        self.kernel_size = kernel_size
+
     def forward(self, Rj, Ai):
-        Ai = torch.autograd.Variable(Ai, requires_grad=True)
-        Ai.retain_grad()
-        Z = self.layer.forward(Ai)
-        Z = self.incr(Z)
-        S = (Rj / Z).data
-        (Z * S).sum().backward()
-        Ci = Ai.grad
+        Z = self.incr(F.avg_pool2d(Ai, self.kernel_size))
+        S = Rj / Z
+
+        # Every input gets an equal share of the window it was pooled in
+        kh, kw = self.kernel_size
+        Ci = S.repeat_interleave(kh, dim=-2).repeat_interleave(kw, dim=-1) / (kh * kw)
+        Ci = F.pad(Ci, (0, Ai.shape[-1] - Ci.shape[-1], 0, Ai.shape[-2] - Ci.shape[-2]))
 
         # Calculate relevance
-        Ri = (Ai * Ci).data
+        Ri = Ai * Ci
 
         # Normalize to ensure relevance conservation
         total_relevance = Rj.sum()
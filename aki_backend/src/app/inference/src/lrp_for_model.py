@@ -1,25 +1,94 @@
 # import torch.nn.functional as F
+import hashlib
+import json
+from collections import defaultdict
+from typing import Dict, List, Optional
+
 import torch.nn as nn
 import torch
 import numpy as np
-from app.inference.src.lrp import LRP
+from app.inference.src.lrp import LRP, Branch, LrpGraph, Trunk
 
+# Bump when the weight transforms of the LRP modules change
+LRP_RULES_VERSION = 1
 
-def construct_lrp(model: nn.Module, device: torch.device):
-    mean = [0.485, 0.456, 0.406]
-    std = [0.229, 0.224, 0.225]
-    mean = torch.FloatTensor(mean).reshape(1, -1, 1, 1).to(device)
-    std = torch.FloatTensor(std).reshape(1, -1, 1, 1).to(device)
 
+def construct_lrp(
+    model: nn.Module,
+    device: torch.device,
+    weights: Optional[Dict[str, torch.Tensor]] = None,
+):
+    """LRP of ``model``, reusing the rule-transformed ``weights`` of
+    ``get_lrp_weights`` when given."""
     model.to(device)
     layers, rules, skip_layers, skip_rules = construct_lrp_layers_and_rules_for_CNN(
         model
     )
+    layer_rules = dict(zip(layers + skip_layers, rules + skip_rules))
+
+    if weights is not None:
+        modules = dict(model.named_modules())
+        weights = {modules[name]: weight for name, weight in weights.items()}
+
+    return LRP(construct_lrp_graph(model), layer_rules, device=device, weights=weights)
 
-    lrp_model = LRP(
-        layers, rules, skip_layers, skip_rules, device=device, mean=None, std=None
+
+def get_lrp_rules_tag(model: nn.Module) -> str:
+    """Digest of the LRP rules of ``model``, changing whenever weights
+    computed by ``get_lrp_weights`` would."""
+    layers, rules, skip_layers, skip_rules = construct_lrp_layers_and_rules_for_CNN(
+        model
+    )
+    names = {module: name for name, module in model.named_modules()}
+    described = [
+        [names[layer], layer.__class__.__name__, sorted(rule.items())]
+        for layer, rule in zip(layers + skip_layers, rules + skip_rules)
+    ]
+    return hashlib.sha256(
+        json.dumps([LRP_RULES_VERSION, described]).encode()
+    ).hexdigest()
+
+
+def get_lrp_weights(lrp_model: LRP, model: nn.Module) -> Dict[str, torch.Tensor]:
+    """Rule-transformed weights of ``lrp_model`` keyed by module name."""
+    names = {module: name for name, module in model.named_modules()}
+    return {
+        names[layer]: weight.cpu() for layer, weight in lrp_model.weights().items()
+    }
+
+
+def construct_lrp_graph(model) -> LrpGraph:
+    num = model.num
+    return LrpGraph(
+        decoder=[model.decoder[2], model.decoder[1], model.decoder[0]],
+        trunks={
+            # Relevance stops short of the first binary block's conv1 and skip
+            "binary": Trunk(
+                model.GAP, [model.res3, model.res2], [model.res1.conv3, model.res1.conv2]
+            ),
+            "ts": Trunk(model.GAP2, [model.res3_2, model.res2_2, model.res1_2]),
+        },
+        branches={
+            "drug": Branch(model.lin1_drug, model.lin1_drug_skip, torch.relu),
+            "info": Branch(model.lin1_info, model.lin1_info_skip, torch.relu),
+            "aki": Branch(model.lin1_d, model.lin1_d_skip, torch.tanh),
+            "ratio": Branch(model.lin1_d_ratio, model.lin1_d_ratio_skip, torch.tanh),
+            "ts": Branch(model.lin1_d_mma, model.lin1_d_mma_skip, torch.tanh),
+            "flag": Branch(model.lin1_d_flag, model.lin1_d_flag_skip, torch.relu),
+            "grad": Branch(model.lin1_d_grad, model.lin1_d_grad_skip, torch.relu),
+        },
+        binary=["drug", "info", "aki"],
+        # Slices are unwound with the attention weights the explanations have
+        # always been computed with, not always their own
+        attentions=[
+            ("ts", "grad", None),
+            ("ratio", "flag", slice(None, num)),
+            ("grad", "ts", None),
+            ("flag", "ratio", None),
+            ("flag", "flag", slice(num, 2 * num)),
+        ],
+        query="ts",
     )
-    return lrp_model
 
 
 def construct_lrp_layers_and_rules_for_CNN(model):
@@ -267,3 +336,65 @@ def construct_lrp_layers_and_rules_for_CNN(model):
     rules.append({"z_plus": False, "epsilon": 2.5e-7})
 
     return layers, rules, skip_layers, skip_rules
+
+
+class ActivationRecorder:
+    """Records what ``modules`` see during the prediction pass.
+
+    The relevance then reuses these activations instead of running the
+    model again.
+    """
+
+    def __init__(self, modules: List[nn.Module]):
+        self.modules = modules
+        self.inputs = defaultdict(list)
+        self.outputs = defaultdict(list)
+        self.handles = []
+
+    def __enter__(self) -> "ActivationRecorder":
+        self.handles = [module.register_forward_hook(self.hook) for module in self.modules]
+        return self
+
+    def __exit__(self, *exc):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+        self.clear()
+
+    def hook(self, module, inputs, output):
+        self.inputs[module].append(inputs[0])
+        self.outputs[module].append(output)
+
+    def clear(self):
+        self.inputs.clear()
+        self.outputs.clear()
+
+    def get_activations(self, rows: torch.Tensor) -> Dict[str, dict]:
+        """Activations of the last recorded batch, restricted to ``rows``."""
+
+        def select(recorded):
+            return {
+                module: [
+                    tensor if len(rows) == len(tensor) else tensor[rows]
+                    for tensor in tensors
+                ]
+                for module, tensors in recorded.items()
+            }
+
+        return {"inputs": select(self.inputs), "outputs": select(self.outputs)}
+
+
+def concat_activations(activations: List[Dict[str, dict]]) -> Dict[str, dict]:
+    if len(activations) == 1:
+        return activations[0]
+
+    return {
+        kind: {
+            module: [
+                torch.cat(tensors)
+                for tensors in zip(*[batch[kind][module] for batch in activations])
+            ]
+            for module in activations[0][kind]
+        }
+        for kind in ["inputs", "outputs"]
+    }
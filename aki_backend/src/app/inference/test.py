@@ -1,6 +1,6 @@
 import os
 import random
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 
@@ -12,9 +12,12 @@ warnings.filterwarnings(action="ignore")
 
 import torch
 from torch.utils.data import DataLoader
+from flask import current_app
 
-from app.inference.model.AKImodel import AKIDataset, ResNet, lrp, predict
-from app.inference.utils.pickle_loader import pickle_load
+from app.inference.model.AKImodel import AKIDataset, ResNet, predict
+from app.inference.model.registry import model_registry
+from app.inference.model.scaler import SCALER_BLOCKS, apply_affine
+from app.inference.utils.columns import others
 
 
 def seed_everything(seed: int = 42):
@@ -31,56 +34,68 @@ device = "cuda" if torch.cuda.is_available() else "cpu"
 
 
 def scale_data(data: List[np.ndarray], path: str) -> List[np.ndarray]:
-    for i in range(data[0].shape[-1]):
-        sc = pickle_load(os.path.join(path, f"scaler0_{i}.pickle"))
-        data[0][:, :, i] = np.array(sc.transform(data[0][:, :, i]))
+    scalers = model_registry.get_compiled_scalers(path)
 
-    sc = pickle_load(os.path.join(path, f"scaler1.pickle"))
-    data[1] = np.array(sc.transform(data[1]))
+    for index, block in zip((0, 1, 2, 3, 5), SCALER_BLOCKS):
+        data[index] = apply_affine(
+            data[index], scalers[f"{block}_scale"], scalers[f"{block}_offset"]
+        )
 
-    for i in range(data[2].shape[-1]):
-        for j in range(data[2].shape[-2]):
-            sc = pickle_load(os.path.join(path, f"scaler2_{i}_{j}.pickle"))
-            data[2][:, :, j, i] = np.array(sc.transform(data[2][:, :, j, i]))
-
-    for i in range(data[3].shape[-1]):
-        sc = pickle_load(os.path.join(path, f"scaler3_{i}.pickle"))
-        data[3][:, :, i] = np.array(sc.transform(data[3][:, :, i]))
+    return data
 
-    for i in range(data[5].shape[-1]):
-        for j in range(data[5].shape[-2]):
-            sc = pickle_load(os.path.join(path, f"scaler_flag_{i}_{j}.pickle"))
-            data[5][:, :, j, i] = np.array(sc.transform(data[5][:, :, j, i]))
 
-    return data
+def get_input_size(data: List[np.ndarray]) -> List[int]:
+    return [
+        data[0].shape[1],
+        data[1].shape[1],
+        data[2].shape[1],
+        data[3].shape[1],
+    ]
 
 
-def load_model(data: List[np.ndarray]) -> ResNet:
-    return ResNet(
-        input_size=[
-            data[0].shape[1],
-            data[1].shape[1],
-            data[2].shape[1],
-            data[3].shape[1],
-        ],
-        classes=1,
-    ).to(device)
+def load_model(data: List[np.ndarray], result_dir: str) -> ResNet:
+    return model_registry.get_model(result_dir, get_input_size(data), device)
 
 
 def predict_and_explain(
-    data: List[np.ndarray], result_dir: str, thresholds: np.ndarray
+    data: List[np.ndarray],
+    result_dir: str,
+    thresholds: np.ndarray,
+    explain: str = "none",
+    info_columns: Optional[List[str]] = None,
 ):
     seed_everything(42)
 
     data = scale_data(data, result_dir)
-    model = load_model(data)
+    model = load_model(data, result_dir)
+    lrp_model = (
+        model_registry.get_lrp(result_dir, get_input_size(data), device)
+        if explain != "none"
+        else None
+    )
 
     test_dataset = AKIDataset(data, thresholds)
-    test_loader = DataLoader(
-        dataset=test_dataset, batch_size=512, shuffle=False, num_workers=4
-    )
+
+    use_data_loader = current_app.config.get("INFERENCE_USE_DATA_LOADER")
+    if use_data_loader is None:
+        use_data_loader = device == "cuda"
+
+    if use_data_loader:
+        test_loader = DataLoader(
+            dataset=test_dataset, batch_size=512, shuffle=False, num_workers=4
+        )
+    else:
+        test_loader = test_dataset.iter_batches(512)
 
     print("Evaluating...")
-    logits, preds, explanations = predict(device, model, result_dir, test_loader)
-    # logits, preds, explanations = lrp(device, model, result_dir, test_loader)
+    with torch.inference_mode():
+        logits, preds, explanations = predict(
+            device,
+            model,
+            test_loader,
+            explain,
+            info_columns or others,
+            lrp_model,
+            current_app.config["INFERENCE_EXPLANATION_TOP_K"],
+        )
     return logits, preds, explanations
@@ -1,128 +1,79 @@
-from typing import Tuple, List
+from typing import Optional, Tuple, List
 
 import pandas as pd
 import numpy as np
 
-from app.inference.utils.columns import (
-    patient_info,
-    dynamic0,
-    vital_signs,
-    dynamic,
-    pre6m,
-    static,
-)
+from app.inference.utils.feature_matrix import FeatureMatrix
+from app.inference.utils.layout import feature_layout
 
 import warnings
 
 warnings.filterwarnings(action="ignore")
 
 
-def df_with_index(tgt: pd.DataFrame, idx_df: pd.DataFrame):
-    return pd.DataFrame.from_records(tgt.values).set_index(idx_df.index).astype("float")
-
-
-def day_by_day(
-    data: pd.DataFrame,
-    flag_data: pd.DataFrame,
-):
-    meta_cols = ['p_id2', 'p_id', 'department', 'month', 'date_now', 'date_admin', 'init_aki']
-
-    # Perform assignments in bulk
-    result = pd.DataFrame(
-        {"day": data["stay_length"] - 1, **{col: data[col] for col in meta_cols}}
+def gather_day_window(
+    matrix: FeatureMatrix,
+    rows: np.ndarray,
+    stay_length: np.ndarray,
+    flags: bool = False,
+    n_days: int = 2,
+) -> Tuple[np.ndarray, List[str]]:
+    """Pull the ``n_days`` days before each row's ``stay_length`` as d1.., dn.."""
+    features = feature_layout.window_features
+    source = matrix.flags if flags else matrix.values
+    first_day = stay_length.astype(int) - n_days
+    days = np.unique(np.concatenate([first_day + i for i in range(n_days)]))
+
+    # Positions of every (day, slot * feature) of the wide dN_S_col layout
+    positions = matrix.index(
+        feature_layout.grid(features, days=tuple(days.tolist())).reshape(len(days), -1)
     )
-    result_flag = pd.DataFrame(
-        {"day": flag_data["stay_length"] - 1, **{col: data[col] for col in meta_cols}}
+    window = [
+        source[rows[:, None], positions[np.searchsorted(days, first_day + i)]]
+        for i in range(n_days)
+    ]
+
+    return (
+        np.concatenate(window, axis=1),
+        list(feature_layout.grid(features, days=tuple(range(1, n_days + 1))).ravel()),
     )
 
-    meta_cols = ["day"] + meta_cols
-
-    def add_day_to_cols(columns: list, day: int):
-        return [f"d{day}_{col}" for col in columns]
-
-    def add_day_and_slot_to_cols(columns: list, day: int):
-        return [f"d{day}_{slot}_{col}" for col in columns for slot in range(1, 4)]
-
-    def add_day_and_slot_to_cols_target(columns: list, day: int, pred=False):
-        pred_type = "target" if pred else "pre"
-        return [
-            f"d{day}_{slot}_{pred_type}_{col}" for col in columns for slot in range(1, 4)
-        ]
-
-    def get_records_by_stay_len(columns: list, col_mapper: callable, offset: int):
-        return lambda row: row[
-            col_mapper(columns, int(row["stay_length"]) + offset)
-        ].values
 
-    result[patient_info[4:] + pre6m] = data[patient_info[4:] + pre6m].copy()
-    result_flag[patient_info[4:] + pre6m] = flag_data[patient_info[4:] + pre6m].copy()
-
-    for i in range(2):
-        result[add_day_and_slot_to_cols(static, i + 1)] = df_with_index(
-            data.apply(
-                get_records_by_stay_len(static, add_day_and_slot_to_cols, i - 2),
-                axis=1,
-            ),
-            data,
-        )
+def day_by_day(
+    matrix: FeatureMatrix,
+    rows: np.ndarray,
+    stay_length: np.ndarray,
+    index: Optional[pd.Index] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    meta_cols = feature_layout.meta_cols
+    info_cols = feature_layout.info_cols
+
+    if index is None:
+        index = matrix.meta.index[rows]
+
+    meta = pd.DataFrame(
+        {
+            "day": stay_length - 1,
+            **{col: matrix.column(col, rows) for col in meta_cols},
+        },
+        index=index,
+    )
 
-        result_flag[add_day_and_slot_to_cols(static, i + 1)] = df_with_index(
-            flag_data.apply(
-                get_records_by_stay_len(static, add_day_and_slot_to_cols, i - 2),
-                axis=1,
-            ),
-            flag_data,
+    def get_window_frame(flags: bool) -> pd.DataFrame:
+        source = matrix.flags if flags else matrix.values
+        window, window_names = gather_day_window(matrix, rows, stay_length, flags)
+        block = np.concatenate(
+            [source[rows[:, None], matrix.index(info_cols)], window], axis=1
         )
+        names = np.array(info_cols + window_names)
+        order = np.argsort(names, kind="stable")
 
-    for type_ in ["max", "min", "avg"]:
-        dy_all = [f"{c}_{type_}" for c in dynamic0 + vital_signs + dynamic[:-2]]
-        for i in range(2):
-            result[add_day_and_slot_to_cols(dy_all, i + 1)] = df_with_index(
-                data.apply(
-                    get_records_by_stay_len(dy_all, add_day_and_slot_to_cols, i - 2),
-                    axis=1,
-                ),
-                data,
-            )
-            result_flag[add_day_and_slot_to_cols(dy_all, i + 1)] = df_with_index(
-                flag_data.apply(
-                    get_records_by_stay_len(dy_all, add_day_and_slot_to_cols, i - 2),
-                    axis=1,
-                ),
-                flag_data,
-            )
-
-    for i in range(2):
-        result[add_day_and_slot_to_cols(["aki", "aki_critical"], i + 1)] = (
-            df_with_index(
-                data.apply(
-                    get_records_by_stay_len(
-                        ["aki", "aki_critical"], add_day_and_slot_to_cols, i - 2
-                    ),
-                    axis=1,
-                ),
-                data,
-            )
-        )
-        result_flag[add_day_and_slot_to_cols(["aki", "aki_critical"], i + 1)] = (
-            df_with_index(
-                flag_data.apply(
-                    get_records_by_stay_len(
-                        ["aki", "aki_critical"], add_day_and_slot_to_cols, i - 2
-                    ),
-                    axis=1,
-                ),
-                flag_data,
-            )
+        return pd.concat(
+            [meta, pd.DataFrame(block[:, order], index=index, columns=names[order])],
+            axis=1,
         )
 
-    cols_arranged = sorted(set(result.columns).difference(meta_cols))
-    cols_arranged = meta_cols + cols_arranged
-
-    result = result[cols_arranged]
-    result_flag = result_flag[cols_arranged]
-
-    return result, result_flag
+    return get_window_frame(False), get_window_frame(True)
 
 
 def make_target(data: pd.DataFrame):
@@ -147,24 +98,56 @@ def make_target(data: pd.DataFrame):
     return target_df
 
 
+def stack_day_windows(
+    rows: np.ndarray, stay_length: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Repeat each row once per past window, shortening its stay_length."""
+    n_windows = (stay_length - 2).astype(int)
+    offsets = np.arange(n_windows.sum()) - np.repeat(
+        np.cumsum(n_windows) - n_windows, n_windows
+    )
+
+    return np.repeat(rows, n_windows), np.repeat(stay_length, n_windows) - offsets
+
+
+def drop_predicted_windows(
+    matrix: FeatureMatrix,
+    rows: np.ndarray,
+    stay_length: np.ndarray,
+    predicted_days: Optional[np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Drop windows whose day was already predicted for the source record."""
+    if predicted_days is None:
+        return rows, stay_length
+
+    last_day = predicted_days[matrix.column("p_id2", rows).astype(int)]
+    keep = stay_length - 1 > last_day
+
+    return rows[keep], stay_length[keep]
+
+
 def day_by_day_with_past(
-    data: pd.DataFrame,
-    data_flag: pd.DataFrame,
+    matrix: FeatureMatrix,
+    batched: bool = False,
+    predicted_days: Optional[np.ndarray] = None,
 ) -> Tuple[List[pd.DataFrame], List[pd.DataFrame]]:
     result = []
     result_flag = []
 
-    data = data.copy()
-    data_flag = data_flag.copy()
+    # Windows are (row, stay_length) pairs gathered from the matrix
+    stay_length = matrix.column("stay_length") - 1
+    rows = np.flatnonzero(stay_length > 2)
+    stay_length = stay_length[rows]
 
-    data["stay_length"] -= 1
-    data_flag["stay_length"] = data["stay_length"].copy()
+    if batched:
+        rows, stay_length = stack_day_windows(rows, stay_length)
 
-    data = data[data["stay_length"] > 2]
-    data_flag = data_flag[data_flag["stay_length"] > 2]
+    rows, stay_length = drop_predicted_windows(matrix, rows, stay_length, predicted_days)
 
-    while len(data) > 0:
-        offset_data, offset_flag = day_by_day(data, data_flag)
+    while len(rows) > 0:
+        offset_data, offset_flag = day_by_day(
+            matrix, rows, stay_length, pd.RangeIndex(len(rows)) if batched else None
+        )
 
         target = make_target(offset_data)
         offset_data = pd.concat([offset_data, target], axis=1)
@@ -173,10 +156,12 @@ def day_by_day_with_past(
         result.append(offset_data)
         result_flag.append(offset_flag)
 
-        data["stay_length"] -= 1
-        data = data[data["stay_length"] > 2]
+        if batched:
+            break
+
+        stay_length = stay_length - 1
+        rows, stay_length = rows[stay_length > 2], stay_length[stay_length > 2]
 
-        data_flag["stay_length"] -= 1
-        data_flag = data_flag[data_flag["stay_length"] > 2]
+        rows, stay_length = drop_predicted_windows(matrix, rows, stay_length, predicted_days)
 
     return result, result_flag
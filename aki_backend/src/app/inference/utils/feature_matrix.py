@@ -0,0 +1,77 @@
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+class FeatureMatrix:
+    """Wide patient features kept as contiguous NumPy blocks.
+
+    ``values`` holds the numeric features, ``flags`` marks the ones missing
+    from the upload and ``meta`` keeps the identifying columns of every row.
+    """
+
+    def __init__(
+        self,
+        values: np.ndarray,
+        flags: np.ndarray,
+        columns: Sequence[str],
+        meta: pd.DataFrame,
+    ):
+        self.values = values
+        self.flags = flags
+        self.columns = list(columns)
+        self.positions: Dict[str, int] = {col: i for i, col in enumerate(self.columns)}
+        self.meta = meta
+
+    @classmethod
+    def from_frame(
+        cls, data: pd.DataFrame, meta_cols: List[str], dtype: str = "float64"
+    ) -> "FeatureMatrix":
+        features = data.drop(columns=meta_cols)
+        values = np.ascontiguousarray(features.to_numpy(dtype=dtype))
+        flags = np.isnan(values).astype(np.int8)
+
+        return cls(values, flags, features.columns, data[meta_cols].copy())
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def index(self, cols) -> np.ndarray:
+        """Positions of ``cols``, shaped like ``cols``."""
+        cols = np.asarray(cols, dtype=object)
+        return np.array(
+            [self.positions[col] for col in cols.ravel()], dtype=int
+        ).reshape(cols.shape)
+
+    def get(self, cols: Sequence[str]) -> np.ndarray:
+        return self.values[:, self.index(cols)]
+
+    def set(self, cols: Sequence[str], block):
+        self.values[:, self.index(cols)] = block
+
+    def set_flags(self, cols: Sequence[str], block):
+        self.flags[:, self.index(cols)] = block
+
+    def column(self, col: str, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        if col in self.meta:
+            column = self.meta[col].to_numpy()
+        else:
+            column = self.values[:, self.positions[col]]
+        return column if rows is None else column[rows]
+
+    def add_columns(self, cols: Sequence[str], value: float = np.nan):
+        """Append the missing ``cols`` filled with ``value``, flagged if NaN."""
+        cols = [col for col in dict.fromkeys(cols) if col not in self.positions]
+        if len(cols) == 0:
+            return
+
+        block = np.full((len(self), len(cols)), value, dtype=self.values.dtype)
+        self.values = np.concatenate([self.values, block], axis=1)
+        self.flags = np.concatenate(
+            [self.flags, np.isnan(block).astype(np.int8)], axis=1
+        )
+
+        for col in cols:
+            self.positions[col] = len(self.columns)
+            self.columns.append(col)
@@ -0,0 +1,109 @@
+from functools import cached_property, lru_cache
+from typing import List, Tuple
+
+import numpy as np
+
+from app.inference.utils.columns import (
+    patient_info,
+    dynamic0,
+    vital_signs,
+    dynamic,
+    pre6m,
+    static,
+    lowhighvalues,
+    minmaxvalues,
+)
+
+TYPES = ("_max", "_min", "_avg")
+
+
+class FeatureLayout:
+    """Column names of the wide dN_S_* layout, compiled once from columns.py.
+
+    Grids are shaped (day, slot, feature, type) so a stage can gather a whole
+    block of a frame with a single lookup. They are shared, so treat them as
+    read-only.
+    """
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def grid(
+        features: Tuple[str, ...],
+        types: Tuple[str, ...] = ("",),
+        days: Tuple[int, ...] = (1, 2),
+        slots: Tuple[int, ...] = (1, 2, 3),
+    ) -> np.ndarray:
+        names = np.array(
+            [
+                f"d{day}_{slot}_{feature}{type_}"
+                for day in days
+                for slot in slots
+                for feature in features
+                for type_ in types
+            ],
+            dtype=object,
+        ).reshape(len(days), len(slots), len(features), len(types))
+        names.flags.writeable = False
+        return names
+
+    @cached_property
+    def dynamic_features(self) -> Tuple[str, ...]:
+        return tuple(dynamic0 + vital_signs + dynamic[:-2])
+
+    @cached_property
+    def meta_cols(self) -> List[str]:
+        return ['p_id2', 'p_id', 'department', 'month', 'date_now', 'date_admin', 'init_aki']
+
+    @cached_property
+    def info_cols(self) -> List[str]:
+        return patient_info[4:] + pre6m
+
+    @cached_property
+    def window_features(self) -> Tuple[str, ...]:
+        """Per-slot features copied into every two-day window."""
+        features = static[:]
+        for type_ in ["max", "min", "avg"]:
+            features += [f"{c}_{type_}" for c in self.dynamic_features]
+        features += ["aki", "aki_critical"]
+        return tuple(features)
+
+    @cached_property
+    def lowhigh(self) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+        """Columns checked against ``lowhighvalues`` with their rule, low and high."""
+        cols, rules, lows, highs = [], [], [], []
+        for i, c in enumerate(lowhighvalues):
+            # Vital sign summaries already carry their type in the name
+            if i < len(lowhighvalues) - 12:
+                var_cols = list(self.grid((c,), ("_max", "_avg", "_min")).ravel())
+            else:
+                var_cols = list(self.grid((c,)).ravel())
+
+            rule, low, high = lowhighvalues[c]
+            cols += var_cols
+            rules += [rule] * len(var_cols)
+            lows += [low] * len(var_cols)
+            highs += [high] * len(var_cols)
+
+        return cols, np.array(rules), np.array(lows, dtype=float), np.array(highs, dtype=float)
+
+    @cached_property
+    def minmax(self) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """Columns clipped by ``limit`` with their upper and lower bounds."""
+        cols, uppers, lowers = [], [], []
+        for i, c in enumerate(minmaxvalues):
+            if i < 4:
+                var_cols = [c]
+            elif "_max" in c or "_avg" in c or "_min" in c:
+                var_cols = list(self.grid((c,)).ravel())
+            else:
+                var_cols = list(self.grid((c,), ("_max", "_avg", "_min")).ravel())
+
+            upper, lower = minmaxvalues[c]
+            cols += var_cols
+            uppers += [upper] * len(var_cols)
+            lowers += [lower] * len(var_cols)
+
+        return cols, np.array(uppers, dtype=float), np.array(lowers, dtype=float)
+
+
+feature_layout = FeatureLayout()
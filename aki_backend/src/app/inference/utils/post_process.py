@@ -1,18 +1,10 @@
 from typing import Tuple
 
-from tqdm import tqdm
-
 import numpy as np
 import pandas as pd
 
-from app.inference.utils.columns import (
-    static,
-    minmaxvalues,
-    lowhighvalues,
-    dynamic0,
-    dynamic,
-    vital_signs,
-)
+from app.inference.utils.columns import static
+from app.inference.utils.layout import feature_layout
 
 import warnings
 
@@ -100,31 +92,27 @@ def limit(data: pd.DataFrame) -> pd.DataFrame:
     # Convert to float once at the start
     data.iloc[:, 7:] = data.iloc[:, 7:].astype(float)
 
-    # Pre-compute column lists
-    for i, c in enumerate(minmaxvalues):
-        if i < 4:
-            # For first 4 columns, use as is
-            data[c] = data[c].clip(upper=minmaxvalues[c][0], lower=minmaxvalues[c][1])
-        else:
-            # Create column names once
-            if "_max" in c or "_avg" in c or "_min" in c:
-                cols = [f"d{d}_{s}_{c}" for d in range(1, 3) for s in range(1, 4)]
-            else:
-                cols = [
-                    f"d{d}_{s}_{c}_{type_}"
-                    for d in range(1, 3)
-                    for s in range(1, 4)
-                    for type_ in ["max", "avg", "min"]
-                ]
-
-            # Vectorized clip operation on all columns at once
-            data[cols] = data[cols].clip(
-                upper=minmaxvalues[c][0], lower=minmaxvalues[c][1]
-            )
+    cols, upper, lower = feature_layout.minmax
+    data.loc[:, cols] = np.clip(data[cols].to_numpy(dtype=float), lower, upper)
 
     return data
 
 
+def apply_lowhigh_rules(
+    values: np.ndarray, rules: np.ndarray, low: np.ndarray, high: np.ndarray, positive_high: bool
+) -> np.ndarray:
+    below = values < low
+    above = values > high
+    if positive_high:
+        above &= values > 0
+
+    return np.select(
+        [rules == 1, rules == 2, rules == 3, rules == 4],
+        [below, above, above | below, 0],
+        values,
+    )
+
+
 def flag_replace(data: pd.DataFrame, flag_data: pd.DataFrame) -> pd.DataFrame:
     print("Flag data replacing to real value...")
     drug_cols_array = []
@@ -132,72 +120,37 @@ def flag_replace(data: pd.DataFrame, flag_data: pd.DataFrame) -> pd.DataFrame:
         drug_cols_array.extend([d + "_" + c for c in static])
     flag_data.loc[:, [f"pre6m_{col}" for col in static]] = 0
     tmp = flag_data.copy().loc[:, drug_cols_array]
-    flag_data = flag_data.replace({0: 1, 1: -1})
-    lowhigh_df = pd.DataFrame(index=data.index)
-    lowhigh_df2 = pd.DataFrame(index=data.index)
-
-    # Pre-compute column names
-    days = range(1, 3)
-    slots = range(1, 4)
-    types = ["max", "avg", "min"]
-
-    for i, c in enumerate(lowhighvalues):
-        # Determine if we're handling regular or special columns
-        is_regular = i < len(lowhighvalues) - 12
-
-        # Generate column names once
-        if is_regular:
-            cols = [
-                f"d{day}_{slot}_{c}_{type_}"
-                for day in days
-                for slot in slots
-                for type_ in types
-            ]
-        else:
-            cols = [f"d{day}_{slot}_{c}" for day in days for slot in slots]
-
-        # Process all columns for this variable at once
-        for col in cols:
-            mask_1 = flag_data[col] == 1
-            flag_data.loc[mask_1, col] = data.loc[mask_1, col]
-            lowhigh_df2[col] = data[col]
-
-            mask_not_neg1 = flag_data[col] != -1
-
-            if lowhighvalues[c][0] == 1:
-                flag_data.loc[mask_not_neg1, col] = (
-                        flag_data.loc[mask_not_neg1, col] < lowhighvalues[c][1]
-                )
-                lowhigh_df2[col] = lowhigh_df2[col] < lowhighvalues[c][1]
-
-            elif lowhighvalues[c][0] == 2:
-                flag_data.loc[mask_not_neg1, col] = (
-                        flag_data.loc[mask_not_neg1, col] > lowhighvalues[c][2]
-                )
-                lowhigh_df2[col] = (lowhigh_df2[col] > lowhighvalues[c][2]) & (
-                        lowhigh_df2[col] > 0
-                )
-
-            elif lowhighvalues[c][0] == 3:
-                flag_data.loc[mask_not_neg1, col] = (
-                                                            flag_data.loc[mask_not_neg1, col] > lowhighvalues[c][2]
-                                                    ) | (flag_data.loc[mask_not_neg1, col] < lowhighvalues[c][1])
-                lowhigh_df2[col] = (
-                                           (lowhigh_df2[col] > lowhighvalues[c][2]) & (lowhigh_df2[col] > 0)
-                                   ) | (lowhigh_df2[col] < lowhighvalues[c][1])
-
-            elif lowhighvalues[c][0] == 4:
-                flag_data.loc[mask_not_neg1, col] = 0
-                lowhigh_df2[col] = 0
-
-            lowhigh_df[col] = flag_data[col]
-
-    lowhigh_df = pd.concat([lowhigh_df, tmp], axis=1)
-    lowhigh_df2 = pd.concat([lowhigh_df2, tmp], axis=1)
+
+    cols, rules, low, high = feature_layout.lowhigh
+    values = data[cols].to_numpy(dtype=float)
+    flags = flag_data[cols].to_numpy(dtype=float)
+
+    # Missing values are flagged -1, present ones are replaced by their value
+    flags = np.where(flags == 0, values, np.where(flags == 1, -1, flags))
+    flags = np.where(
+        flags != -1, apply_lowhigh_rules(flags, rules, low, high, False), flags
+    )
+    values = apply_lowhigh_rules(values, rules, low, high, True)
+
+    lowhigh_df = pd.concat(
+        [pd.DataFrame(flags, index=data.index, columns=cols), tmp], axis=1
+    )
+    lowhigh_df2 = pd.concat(
+        [pd.DataFrame(values, index=data.index, columns=cols), tmp], axis=1
+    )
 
     return lowhigh_df, lowhigh_df2
 
 
+def assign_columns(frame: pd.DataFrame, block: pd.DataFrame) -> pd.DataFrame:
+    """Set all of ``block``'s columns on ``frame``, appending the new ones."""
+    existing = block.columns[block.columns.isin(frame.columns)]
+    for col in existing:
+        frame[col] = block[col]
+
+    return pd.concat([frame, block.drop(columns=existing)], axis=1)
+
+
 def get_side_effects(data: pd.DataFrame, flag_data: pd.DataFrame):
     print("Calculating side effects...")
     side_effects = ['nephro_toxic', 'renal_relevant', 'bp_up', 'bp_down', 'pr_relevant', 'hemodynamic',
@@ -224,26 +177,30 @@ def get_side_effects(data: pd.DataFrame, flag_data: pd.DataFrame):
                        'vasopressor', 'tnx']
     days = ['pre6m', 'd1_1', 'd1_2', 'd1_3', 'd2_1', 'd2_2', 'd2_3']
 
-    # Vectorized operations for side effects
-    for effect in tqdm(side_effects):
-        pres_index = relevant_index[effect]
+    contrast_days = ['d1_1', 'd1_2', 'd1_3', 'd2_1', 'd2_2', 'd2_3']
+    pres_cols = [f"{day}_{base}" for day in days for base in base_pres_names]
 
-        for day in days:
-            column_name = f"{day}_{effect}"
-            pres_names = [f"{day}_{base}" for base in base_pres_names]
-            selected_pres = [pres_names[idx] for idx in pres_index]
-            data[column_name] = data[selected_pres].any(axis=1)
-            flag_data[column_name] = flag_data[selected_pres].any(axis=1)
+    def get_effects(frame: pd.DataFrame) -> pd.DataFrame:
+        pres = frame[pres_cols].to_numpy(dtype=float).reshape(
+            len(frame), len(days), len(base_pres_names)
+        )
+        prescribed = (pres != 0) & ~np.isnan(pres)
 
-    # Handle contrast effects
-    contrast_days = ['d1_1', 'd1_2', 'd1_3', 'd2_1', 'd2_2', 'd2_3']
-    for day in contrast_days:
-        contrast_col = f"{day}_contrast"
-        data[f"{day}_nephro_toxic"] = data[contrast_col]
-        data[f"{day}_tubular"] = data[contrast_col]
-        flag_data[f"{day}_nephro_toxic"] = flag_data[contrast_col]
-        flag_data[f"{day}_tubular"] = flag_data[contrast_col]
-    return data, flag_data
+        effects = {}
+        for effect in side_effects:
+            effect_days = prescribed[:, :, relevant_index[effect]].any(axis=2)
+            for i, day in enumerate(days):
+                effects[f"{day}_{effect}"] = effect_days[:, i]
+
+        # Handle contrast effects
+        for day in contrast_days:
+            contrast = frame[f"{day}_contrast"].to_numpy()
+            effects[f"{day}_nephro_toxic"] = contrast
+            effects[f"{day}_tubular"] = contrast
+
+        return assign_columns(frame, pd.DataFrame(effects, index=frame.index))
+
+    return get_effects(data), get_effects(flag_data)
 
 
 def get_binary(data: pd.DataFrame, data_flag: pd.DataFrame):
@@ -307,66 +264,41 @@ def get_binary(data: pd.DataFrame, data_flag: pd.DataFrame):
 def get_ratio(data: pd.DataFrame, data_flag: pd.DataFrame):
     print("Calculate Ratio...")
 
-    cols = dynamic0 + vital_signs + dynamic[:-2]
-    types = ["max", "avg", "min"]
-
-    # Pre-compute all column names
-    all_cols = []
-    for day in range(1, 3):
-        for slot in range(1, 4):
-            for c in cols:
-                for type_ in types:
-                    all_cols.append(f"d{day}_{slot}_{c}_{type_}")
-
-    # Create ratio and gradient columns at once
-    ratio_cols = [col + "_ratio" for col in all_cols]
-    gradient_cols = [col + "_gradient" for col in all_cols]
-    data[ratio_cols] = 0
-    data[gradient_cols] = 0
-
-    # Process each time slot efficiently
-    for day in range(1, 3):
-        for slot in range(1, 4):
-            if day == 1 and slot == 1:
-                continue
-
-            # Get current and previous slot indices
-            if (day == 2 and slot == 1) or (day == 3 and slot == 1):
-                prev_day, prev_slot = day - 1, 3
-            else:
-                prev_day, prev_slot = day, slot - 1
-
-            # Vectorized computation for all columns in current time slot
-            for c in cols:
-                curr_cols = [f"d{day}_{slot}_{c}_{type_}" for type_ in types]
-                prev_cols = [f"d{prev_day}_{prev_slot}_{c}_{type_}" for type_ in types]
-                curr_cr = [f"d{day}_{slot}_creatinine_{type_}" for type_ in types]
-                prev_cr = [
-                    f"d{prev_day}_{prev_slot}_creatinine_{type_}" for type_ in types
-                ]
-
-                ratio_cols = [f"{col}_ratio" for col in curr_cols]
-                gradient_cols = [f"{col}_gradient" for col in curr_cols]
-
-                # Mask for non-zero previous values
-                mask = data[prev_cols[0]] != 0
-
-                # Vectorized ratio calculation
-                if mask.any():
-                    data.loc[mask, ratio_cols] = (
-                                                         data.loc[mask, curr_cols].values
-                                                         - data.loc[mask, prev_cols].values
-                                                 ) / data.loc[mask, prev_cols].values
-
-                    # Vectorized gradient calculation
-                    data.loc[mask, gradient_cols] = (
-                                                            data.loc[mask, curr_cols].values
-                                                            - data.loc[mask, prev_cols].values
-                                                    ) / (
-                                                            data.loc[mask, curr_cr].values
-                                                            - data.loc[mask, prev_cr].values
-                                                            + 1e-4
-                                                    )
+    features = feature_layout.dynamic_features
+    types = ("_max", "_avg", "_min")
+
+    # (rows, slot, feature, type) view of the dynamic block
+    names = feature_layout.grid(features, types)
+    values = data[names.ravel()].to_numpy(dtype=float).reshape(
+        len(data), 6, len(features), len(types)
+    )
+    creatinine = data[feature_layout.grid(("creatinine",), types).ravel()].to_numpy(
+        dtype=float
+    ).reshape(len(data), 6, 1, len(types))
+
+    curr, prev = values[:, 1:], values[:, :-1]
+    # Slots whose previous max is zero keep a zero ratio and gradient
+    mask = np.broadcast_to(prev[..., :1] != 0, prev.shape)
+
+    ratio = np.zeros_like(values)
+    gradient = np.zeros_like(values)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio[:, 1:][mask] = ((curr - prev) / prev)[mask]
+        gradient[:, 1:][mask] = (
+            (curr - prev) / (creatinine[:, 1:] - creatinine[:, :-1] + 1e-4)
+        )[mask]
+
+    ratio_block = pd.DataFrame(
+        np.concatenate(
+            [ratio.reshape(len(data), -1), gradient.reshape(len(data), -1)], axis=1
+        ),
+        index=data.index,
+        columns=[
+            *feature_layout.grid(features, tuple(t + "_ratio" for t in types)).ravel(),
+            *feature_layout.grid(features, tuple(t + "_gradient" for t in types)).ravel(),
+        ],
+    )
+    data = pd.concat([data, ratio_block], axis=1)
 
     data.fillna(0, inplace=True)
     data.replace([np.inf, -np.inf], 0, inplace=True)
@@ -15,6 +15,7 @@ from app.inference.utils.columns import (
     cancer_name,
     final_target,
 )
+from app.inference.utils.layout import feature_layout
 
 import warnings
 
@@ -90,7 +91,7 @@ def format_by_temporal_type(
     # """
 
     microalbumins = [c for c in data.columns if "microalbumin" in c]
-    meta_data = data[["day", "department"]]
+    meta_data = data[["day", "department", "p_id2"]]
 
     data = data.drop(
         columns=["pre_aki", "day", "p_id", "p_id2"] + microalbumins + cancer_name
@@ -175,57 +176,43 @@ def mk_dynamic_temporal(
             "urine_protein_cr_ratio",
         ]
         types = ["max"]
-    # Pre-calculate all column names once
-    all_col_sets = []
-    for type_ in types:
-        for d in ["d1_1", "d1_2", "d1_3", "d2_1", "d2_2", "d2_3"]:
-            all_col_sets.extend(
-                [
-                    [f"{d}_{c}_{type_}" for c in dynamics],  # base columns
-                    [f"{d}_{c}_{type_}_ratio" for c in dynamics],  # ratio columns
-                    [f"{d}_{c}_{type_}_gradient" for c in dynamics],  # gradient columns
-                ]
-            )
-
-    # Pre-allocate numpy arrays with known shapes
-    n_samples = len(data)
-    n_features = len(dynamics)
-    arrays = {
-        "base": np.zeros(
-            (len(types), 6, n_samples, n_features)
-        ),  # [type, time, samples, features]
-        "flag": np.zeros((len(types), 6, n_samples, n_features)),
-        "flag2": np.zeros((len(types), 6, n_samples, n_features)),
-        "flag3": np.zeros((len(types), 6, n_samples, n_features)),
-        "flag4": np.zeros((len(types), 6, n_samples, n_features)),
-    }
-
-    # Fill arrays directly without intermediate lists
-    for t_idx, type_ in enumerate(types):
-        for d_idx, d in enumerate(["d1_1", "d1_2", "d1_3", "d2_1", "d2_2", "d2_3"]):
-            base_cols = [d + "_" + c + "_" + type_ for c in dynamics]
-            ratio_cols = [d + "_" + c + "_" + type_ + "_ratio" for c in dynamics]
-            grad_cols = [d + "_" + c + "_" + type_ + "_gradient" for c in dynamics]
-
-            arrays["base"][t_idx, d_idx] = data[base_cols].values
-            arrays["flag"][t_idx, d_idx] = data_flag[base_cols].values
-            arrays["flag2"][t_idx, d_idx] = data_flag2[base_cols].values
-            arrays["flag3"][t_idx, d_idx] = data[ratio_cols].values
-            arrays["flag4"][t_idx, d_idx] = data[grad_cols].values
-
-    # Transpose once at the end
-    ts_np = arrays["base"].transpose(2, 3, 0, 1)
+    dynamics = tuple(dynamics)
+    types = tuple("_" + type_ for type_ in types)
+    n_samples, n_features, n_types = len(data), len(dynamics), len(types)
+
+    def gather(frame: pd.DataFrame, suffix: str = "") -> np.ndarray:
+        names = feature_layout.grid(dynamics, tuple(t + suffix for t in types))
+        # (samples, time, feature, type) -> (samples, feature, type, time)
+        return (
+            frame[names.ravel()]
+            .to_numpy(dtype=float)
+            .reshape(n_samples, 6, n_features, n_types)
+            .transpose(0, 2, 3, 1)
+        )
+
+    ts_np = gather(data)
     ts_np_flag = np.concatenate(
         [
-            arrays["flag"].transpose(2, 3, 0, 1),
-            arrays["flag2"].transpose(2, 3, 0, 1),
-            arrays["flag3"].transpose(2, 3, 0, 1),
-            arrays["flag4"].transpose(2, 3, 0, 1),
+            gather(data_flag),
+            gather(data_flag2),
+            gather(data, "_ratio"),
+            gather(data, "_gradient"),
         ],
         axis=2,
     )
 
-    return (ts_np, ts_np_flag), np.hstack(np.array(all_col_sets))
+    # Names ordered by type, time, then base/ratio/gradient features
+    all_col_sets = np.stack(
+        [
+            feature_layout.grid(dynamics, tuple(t + suffix for t in types))
+            .reshape(6, n_features, n_types)
+            .transpose(2, 0, 1)
+            for suffix in ["", "_ratio", "_gradient"]
+        ],
+        axis=2,
+    )
+
+    return (ts_np, ts_np_flag), all_col_sets.ravel().astype(str)
 
 
 def mk_binary_dy_temporal(data: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
@@ -257,4 +244,4 @@ def mk_pinfo_temporal(
         cols_to_preserve = [c for c in data.columns if c not in all_drop_cols]
     cols_to_preserve.append("Cr_kidigo")
 
-    return np.array(data[cols_to_preserve].values)
+    return np.array(data[cols_to_preserve].values), cols_to_preserve
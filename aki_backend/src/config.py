@@ -29,6 +29,28 @@ class Config:
 
     INFERENCE_DATA_DIR = os.path.join(APP_DIR, "inference/data")
     INFERENCE_BATCH_SIZE = 512
+    # Build every past day window in one frame instead of one frame per day
+    INFERENCE_BATCH_DAY_WINDOWS = True
+    # DataLoader workers for inference batches, None uses them only on CUDA
+    INFERENCE_USE_DATA_LOADER = None
+    # Rows read at a time from uploaded medical record files
+    INFERENCE_CSV_CHUNK_SIZE = 1000
+    # Seconds a prediction worker waits for new records between polls
+    INFERENCE_WORKER_POLL_INTERVAL = 10
+    # Longest a prediction worker backs off for after consecutive failures
+    INFERENCE_WORKER_MAX_BACKOFF = 300
+    # Failed predictions after which a record is no longer claimed
+    INFERENCE_MAX_PREDICTION_ATTEMPTS = 3
+    # Processes predict_aki shards records across, by patient
+    INFERENCE_WORKERS = 1
+    # Dtype of the wide feature matrix, float32 halves its memory but can
+    # flip comparisons of values lying exactly on a clinical threshold
+    INFERENCE_FEATURE_DTYPE = "float64"
+    # Predictions explained with LRP: "none", "mild" (positive ones) or "all"
+    INFERENCE_EXPLAIN = "mild"
+    # Largest attributions kept per explained prediction, at least the
+    # number of explanations the record schemas show
+    INFERENCE_EXPLANATION_TOP_K = 10
 
     SQLALCHEMY_DATABASE_URI = DBConfig.get_db_uri()
     SQLALCHEMY_TRACK_MODIFICATIONS = False
@@ -36,6 +58,8 @@ class Config:
     # SQLALCHEMY_ECHO = True
 
     THREADS_PER_PAGE = 2
+    # Rendered prediction detail payloads each API worker keeps in memory
+    PREDICTIONS_PAYLOAD_CACHE_SIZE = 256
 
     PROPAGATE_EXCEPTIONS = True
     JWT_BLACKLIST_ENABLED = True  # enable blacklist feature
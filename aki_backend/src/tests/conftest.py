@@ -0,0 +1,56 @@
+import os
+import tempfile
+import datetime as dt
+
+import pytest
+
+# The app binds its engine on import, so point it at a scratch SQLite file
+# before anything imports it. The URI is "sqlite://" + DB_DATABASE + ".db"
+os.environ["DB_CONNECTION"] = "sqlite"
+os.environ["DB_DATABASE"] = "/" + os.path.join(tempfile.mkdtemp(), "aki")
+
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.dialects.postgresql import JSONB
+
+
+@compiles(JSONB, "sqlite")
+def compile_jsonb_sqlite(type_, compiler, **kw):
+    return "JSON"
+
+
+from app import app as application
+from app.core.database import db
+from app.domain.user.entities.user import User
+from app.domain.patient.entities.patient import Patient
+from app.domain.patient.entities.medical_record import MedicalRecord
+
+
+@pytest.fixture
+def app():
+    with application.app_context():
+        db.drop_all()
+        db.create_all()
+        yield application
+        db.session.remove()
+
+
+@pytest.fixture
+def user(app):
+    user = User("tester", "tester")
+    user.save()
+    return user
+
+
+@pytest.fixture
+def medical_record(user):
+    medical_record = MedicalRecord(user.id, "records.csv")
+    medical_record.save()
+    return medical_record
+
+
+@pytest.fixture
+def patients(app):
+    patients = [Patient(f"P{i}", dt.datetime(2020, 1, 1)) for i in range(3)]
+    db.session.add_all(patients)
+    db.session.commit()
+    return patients
@@ -0,0 +1,33 @@
+import datetime as dt
+
+from app.domain.patient.entities.patient import PatientMedicalRecord
+
+
+def make_prediction(scores):
+    return {"explanations": {"1": [[name, score] for name, score in scores]}}
+
+
+def make_record(prediction):
+    record = PatientMedicalRecord(1, 1, {}, dt.datetime(2020, 1, 1))
+    record.prediction = prediction
+    return record
+
+
+def test_top_explanations_follow_reassigned_prediction():
+    record = make_record(make_prediction([("cr", 0.9), ("bun", 0.5)]))
+    assert record.get_top_explanations_by_day(1) == {"1": {"cr": 0.9}}
+    assert record.get_top_explanations_in_any(1) == {"cr": ["1"]}
+
+    record.prediction = make_prediction([("bun", 0.7)])
+    assert record.get_top_explanations_by_day(1) == {"1": {"bun": 0.7}}
+    assert record.get_top_explanations_in_any(1) == {"bun": ["1"]}
+
+
+def test_top_explanations_are_copies():
+    record = make_record(make_prediction([("cr", 0.9), ("bun", 0.5)]))
+
+    record.get_top_explanations_by_day(2)["1"].pop("cr")
+    record.get_top_explanations_in_any(2)["cr"].append("2")
+
+    assert record.get_top_explanations_by_day(2) == {"1": {"cr": 0.9, "bun": 0.5}}
+    assert record.get_top_explanations_in_any(2) == {"cr": ["1"], "bun": ["1"]}
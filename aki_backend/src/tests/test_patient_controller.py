@@ -0,0 +1,64 @@
+import datetime as dt
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from app.domain.patient.controllers import patient_controller
+from app.domain.patient.entities.patient import PatientMedicalRecord
+
+
+def make_prediction(threshold):
+    return {
+        "logits": {"1": 0.2},
+        "prediction": {"1": False},
+        "explanations": {"1": [["cr", 0.5]]},
+        "threshold": {"1": threshold},
+    }
+
+
+@pytest.fixture
+def record(patients, medical_record):
+    record = PatientMedicalRecord(
+        patients[0].id, medical_record.id, {"p_id": patients[0].external_id}, dt.datetime(2020, 1, 1)
+    )
+    record.fill(
+        {
+            "prediction_state": PatientMedicalRecord.PredictionStates.safe,
+            "prediction": make_prediction(0.5),
+            "updated_at": dt.datetime(2000, 1, 1),
+        }
+    )
+    record.save()
+    return record
+
+
+@pytest.fixture
+def client(app, user):
+    patient_controller.prediction_payloads.clear()
+    client = app.test_client()
+    client.environ_base["HTTP_AUTHORIZATION"] = (
+        f"Bearer {create_access_token(identity=str(user.id))}"
+    )
+    return client
+
+
+def test_predictions_revalidate_by_etag(client, record):
+    url = f"/api/patients/predictions/{record.id}"
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.json["data"]["prediction"]["threshold"] == 0.5
+    etag = response.headers["ETag"]
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.data == b""
+
+    record.prediction = make_prediction(0.9)
+    record.save()
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json["data"]["prediction"]["threshold"] == 0.9
@@ -0,0 +1,130 @@
+import os
+import importlib.util
+import datetime as dt
+
+import numpy as np
+
+from config import Config
+
+from app.core.database import db
+from app.domain.patient.entities.patient import PatientMedicalRecord
+from app.domain.patient.services.patient_medical_record_service import (
+    PatientMedicalRecordService,
+    UPSERT_INSERTS,
+)
+
+States = PatientMedicalRecord.PredictionStates
+STALE_UPDATED_AT = dt.datetime(2000, 1, 1)
+
+
+def make_datum(p_id, date_admin, value):
+    return {"p_id": p_id, "date_admin": date_admin, "age": 60, "cr": value}
+
+
+def upsert(data, patients, medical_record):
+    PatientMedicalRecordService.upsert_many_from_records(
+        data, patients, medical_record.id, UPSERT_INSERTS["sqlite"]
+    )
+    db.session.commit()
+
+
+def predict_all():
+    db.session.execute(
+        PatientMedicalRecord.__table__.update().values(
+            prediction_state=States.safe,
+            prediction={"logits": {"1": 0.1}},
+            prediction_attempts=2,
+            updated_at=STALE_UPDATED_AT,
+        )
+    )
+    db.session.commit()
+    db.session.expire_all()
+
+
+def get_records():
+    return {
+        (record.patient_id, record.reference_date.strftime("%Y-%m-%d")): record
+        for record in PatientMedicalRecord.query.all()
+    }
+
+
+def test_upsert_merges_keys_repeated_across_chunks(
+    patients, medical_record, monkeypatch
+):
+    monkeypatch.setattr(PatientMedicalRecordService, "INSERT_BATCH_SIZE", 2)
+    first = [make_datum(p.external_id, "2020-01-01", 1.0) for p in patients]
+    second = [
+        make_datum(patients[0].external_id, "2020-01-01", 1.0),
+        make_datum(patients[1].external_id, "2020-01-01", 2.0),
+        make_datum(patients[1].external_id, "2020-01-02", 3.0),
+    ]
+
+    upsert(first, patients, medical_record)
+    predict_all()
+    upsert(second, patients, medical_record)
+
+    records = get_records()
+    assert len(records) == 4
+
+    unchanged = records[(patients[0].id, "2020-01-01")]
+    assert unchanged.prediction_state == States.safe
+    assert unchanged.prediction == {"logits": {"1": 0.1}}
+    assert unchanged.prediction_attempts == 2
+    assert unchanged.updated_at == STALE_UPDATED_AT
+
+    changed = records[(patients[1].id, "2020-01-01")]
+    assert changed.data["cr"] == 2.0
+    assert changed.prediction_state == States.unknown
+    assert changed.prediction_attempts == 0
+    assert changed.updated_at > STALE_UPDATED_AT
+
+    created = records[(patients[1].id, "2020-01-02")]
+    assert created.prediction_state == States.unknown
+
+
+def test_upsert_ignores_numeric_representation(patients, medical_record):
+    upsert([make_datum(patients[0].external_id, "2020-01-01", 1.0)], patients, medical_record)
+    predict_all()
+    upsert([make_datum(patients[0].external_id, "2020-01-01", 1)], patients, medical_record)
+
+    (record,) = get_records().values()
+    assert record.prediction_state == States.safe
+    assert record.updated_at == STALE_UPDATED_AT
+
+
+def reupload(data, patients, medical_record):
+    PatientMedicalRecordService.find_or_create_many_from_records(
+        data, patients, medical_record.id
+    )
+    db.session.commit()
+
+
+def test_reupload_keeps_unchanged_predictions(patients, medical_record):
+    data = [make_datum(p.external_id, "2020-01-01", 1.0) for p in patients[:2]]
+    reupload(data, patients, medical_record)
+    predict_all()
+
+    data[1] = make_datum(patients[1].external_id, "2020-01-01", 5.0)
+    reupload(data, patients, medical_record)
+
+    records = get_records()
+    kept = records[(patients[0].id, "2020-01-01")]
+    assert kept.prediction_state == States.safe
+    assert kept.prediction == {"logits": {"1": 0.1}}
+
+    requeued = records[(patients[1].id, "2020-01-01")]
+    assert requeued.prediction_state == States.unknown
+    assert requeued.prediction_attempts == 0
+    assert requeued.data["cr"] == 5.0
+
+
+def test_backfilled_digests_match_uploads():
+    spec = importlib.util.spec_from_file_location(
+        "backfill_data_digests",
+        os.path.join(Config.DB_MIGRATION_DIR, "versions", "5d2e7b9c4f18_.py"),
+    )
+    backfill = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(backfill)
+
+    datum = {"p_id": "P0", "age": np.int64(60), "cr": 1.0, "bun": float("nan")}
+    assert backfill.get_data_digest(datum) == PatientMedicalRecord.get_data_digest(datum)
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+from app.inference.utils.columns import dynamic0, dynamic, vital_signs
+from app.inference.utils.post_process import get_ratio
+
+
+def get_ratio_reference(data: pd.DataFrame, data_flag: pd.DataFrame):
+    """get_ratio as it was before it worked on the whole slot block."""
+    cols = dynamic0 + vital_signs + dynamic[:-2]
+    types = ["max", "avg", "min"]
+
+    all_cols = []
+    for day in range(1, 3):
+        for slot in range(1, 4):
+            for c in cols:
+                for type_ in types:
+                    all_cols.append(f"d{day}_{slot}_{c}_{type_}")
+
+    ratio_cols = [col + "_ratio" for col in all_cols]
+    gradient_cols = [col + "_gradient" for col in all_cols]
+    data[ratio_cols] = 0.0
+    data[gradient_cols] = 0.0
+
+    for day in range(1, 3):
+        for slot in range(1, 4):
+            if day == 1 and slot == 1:
+                continue
+
+            if (day == 2 and slot == 1) or (day == 3 and slot == 1):
+                prev_day, prev_slot = day - 1, 3
+            else:
+                prev_day, prev_slot = day, slot - 1
+
+            for c in cols:
+                curr_cols = [f"d{day}_{slot}_{c}_{type_}" for type_ in types]
+                prev_cols = [f"d{prev_day}_{prev_slot}_{c}_{type_}" for type_ in types]
+                curr_cr = [f"d{day}_{slot}_creatinine_{type_}" for type_ in types]
+                prev_cr = [
+                    f"d{prev_day}_{prev_slot}_creatinine_{type_}" for type_ in types
+                ]
+
+                ratio_cols = [f"{col}_ratio" for col in curr_cols]
+                gradient_cols = [f"{col}_gradient" for col in curr_cols]
+
+                mask = data[prev_cols[0]] != 0
+
+                if mask.any():
+                    data.loc[mask, ratio_cols] = (
+                        data.loc[mask, curr_cols].values
+                        - data.loc[mask, prev_cols].values
+                    ) / data.loc[mask, prev_cols].values
+
+                    data.loc[mask, gradient_cols] = (
+                        data.loc[mask, curr_cols].values
+                        - data.loc[mask, prev_cols].values
+                    ) / (
+                        data.loc[mask, curr_cr].values
+                        - data.loc[mask, prev_cr].values
+                        + 1e-4
+                    )
+
+    data.fillna(0, inplace=True)
+    data.replace([np.inf, -np.inf], 0, inplace=True)
+
+    return data
+
+
+def make_wide_frame(n_rows: int = 40, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    features = dynamic0 + vital_signs + dynamic[:-2]
+    columns = [
+        f"d{day}_{slot}_{c}_{type_}"
+        for day in range(1, 3)
+        for slot in range(1, 4)
+        for c in features
+        for type_ in ["max", "avg", "min"]
+    ]
+    values = rng.normal(10, 5, size=(n_rows, len(columns)))
+
+    # Previous max slots of zero, missing values and infinities
+    values[rng.random(values.shape) < 0.1] = 0
+    values[rng.random(values.shape) < 0.05] = np.nan
+    values[rng.random(values.shape) < 0.02] = np.inf
+    values[rng.random(values.shape) < 0.02] = -np.inf
+    # Equal creatinine across slots drives the gradient denominator to 1e-4
+    values[:5, [i for i, col in enumerate(columns) if "_creatinine_" in col]] = 1.0
+
+    data = pd.DataFrame(values, columns=columns)
+    data["p_id"] = np.arange(n_rows)
+    return data
+
+
+def test_get_ratio_matches_reference():
+    data = make_wide_frame()
+
+    expected = get_ratio_reference(data.copy(), pd.DataFrame())
+    result = get_ratio(data.copy(), pd.DataFrame())
+
+    assert sorted(result.columns) == sorted(expected.columns)
+    np.testing.assert_allclose(
+        result[expected.columns].to_numpy(dtype=float),
+        expected.to_numpy(dtype=float),
+        rtol=1e-12,
+        atol=0,
+    )
@@ -0,0 +1,100 @@
+import time
+import datetime as dt
+
+import pytest
+
+from config import Config
+from app.core.database import db
+from app.domain.patient.entities.patient import PatientMedicalRecord
+from app.domain.patient.services import prediction_service
+from app.domain.patient.services.prediction_service import PredictionService
+from app.domain.patient.services.patient_medical_record_service import (
+    PatientMedicalRecordService,
+)
+
+States = PatientMedicalRecord.PredictionStates
+
+
+@pytest.fixture
+def records(patients, medical_record):
+    records = [
+        PatientMedicalRecord(
+            patient.id, medical_record.id, {"p_id": patient.external_id}, dt.datetime(2020, 1, 1)
+        )
+        for patient in patients
+    ]
+    db.session.add_all(records)
+    db.session.commit()
+    return [record.id for record in records]
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    return sleeps
+
+
+def stub_predict_aki(monkeypatch, fail_ids, error=ValueError):
+    def predict_aki(records):
+        for record in records:
+            if record.id in fail_ids:
+                raise error(f"cannot predict record {record.id}")
+        return [{"prediction": {"1": False}, "logits": {"1": 0.1}} for _ in records]
+
+    monkeypatch.setattr(prediction_service, "predict_aki", predict_aki)
+
+
+def get_states():
+    db.session.expire_all()
+    return {
+        record.id: (record.prediction_state, record.prediction_attempts)
+        for record in PatientMedicalRecord.query.all()
+    }
+
+
+def test_failing_record_does_not_block_the_rest(records, sleeps, monkeypatch):
+    stub_predict_aki(monkeypatch, {records[1]})
+
+    PredictionService.run_worker(limit=10, poll_interval=1, drain=True)
+
+    max_attempts = Config.INFERENCE_MAX_PREDICTION_ATTEMPTS
+    assert get_states() == {
+        records[0]: (States.safe, 0),
+        records[1]: (States.unknown, max_attempts),
+        records[2]: (States.safe, 0),
+    }
+    assert sleeps == []
+
+
+def test_data_errors_on_every_record_are_counted(records, sleeps, monkeypatch):
+    stub_predict_aki(monkeypatch, set(records))
+
+    PredictionService.run_worker(limit=10, poll_interval=1, drain=True)
+
+    max_attempts = Config.INFERENCE_MAX_PREDICTION_ATTEMPTS
+    assert set(get_states().values()) == {(States.unknown, max_attempts)}
+    assert sleeps == []
+
+
+def test_batch_wide_errors_back_off_without_counting(records, sleeps, monkeypatch):
+    stub_predict_aki(monkeypatch, set(records), error=RuntimeError)
+
+    PredictionService.run_worker(limit=10, poll_interval=1, drain=True)
+
+    assert set(get_states().values()) == {(States.unknown, 0)}
+    assert sleeps == [1, 2]
+
+
+def test_storage_failure_backs_off_without_counting(records, sleeps, monkeypatch):
+    stub_predict_aki(monkeypatch, {records[1]})
+
+    def fail(*args):
+        raise RuntimeError("storage is down")
+
+    monkeypatch.setattr(PatientMedicalRecordService, "_update_prediction", fail)
+
+    PredictionService.run_worker(limit=10, poll_interval=1, drain=True)
+
+    assert set(get_states().values()) == {(States.unknown, 0)}
+    assert sleeps == [1, 2]